@@ -1,111 +1,58 @@
-from flask import Flask, render_template, Response, request, jsonify, redirect, url_for
-from transformers import T5Tokenizer, T5ForConditionalGeneration
-import torch
+from flask import Flask, render_template, Response, request, jsonify, redirect, url_for, abort
 import detector
-import time
+import t5_generator
 import numpy as np
 import cv2
-import traceback
-import threading
-
-from detector import start_detector_thread, CURRENT_PREDICTION_DATA, CURRENT_FRAME, STATE_LOCK, FRAME_LOCK
-from config import FLASK_HOST, FLASK_PORT, VIDEO_SOURCE, TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_FROM_NUMBER
-from resources import RESOURCE_RECEIVERS
-from twilio.rest import Client
-from twilio.twiml.messaging_response import MessagingResponse
-
-from pymongo import MongoClient
-from datetime import datetime
-
-app = Flask(__name__)
-
-# --- MongoDB Setup ---
-try:
-    client_mongo = MongoClient("mongodb://localhost:27017/", serverSelectionTimeoutMS=5000)
-    client_mongo.server_info()
-    db = client_mongo.resq
-    report_collection = db.report
-except Exception as e:
-    print("MongoDB connection failed:", e)
-    report_collection = None
-
-# --- Load T5 model ---
-tokenizer = T5Tokenizer.from_pretrained("t5-small")
-model = T5ForConditionalGeneration.from_pretrained("t5-small")
-
-# --- Start Detector Thread ---
-start_detector_thread(
-    video_source=VIDEO_SOURCE,
-    model_dir="mobilenet",
-    conf_threshold=0.5,
-    inference_delay=0.08
+import json
+import requests
+
+import dispatch_service
+from detector import start_detector_engine, register_camera, get_camera
+from shared_frames import attach_remote_camera
+from config import (
+    FLASK_HOST, FLASK_PORT, VIDEO_SOURCES, DEFAULT_CAMERA_ID, T5_WARMUP, STREAM_TIERS, DEFAULT_STREAM_TIER,
+    HISTORY_PAGE_SIZE, STATS_DEFAULT_RANGE_HOURS, DETECTOR_MODE, DISPATCH_CONTROL_HOST, DISPATCH_CONTROL_PORT,
+    DISPATCH_CONTROL_TIMEOUT
 )
 
-# --- Twilio Client ---
-twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+from db_utils import get_collection, query_history
+from rollups import INCIDENT_ROLLUPS, ROLLUP_DISPATCHED
+from metrics import REGISTRY
+from datetime import datetime, timedelta
 
-# --- Dispatch State ---
-dispatch_state = {
-    "status": "Not Sent",
-    "timestamp": None,
-    "receivers_map": {},
-    "sids": {},
-}
+app = Flask(__name__)
 
-# --- Helper: Send WhatsApp with SMS fallback ---
-def send_message_with_fallback(to_number, resource, incident_type, location, timestamp):
-    body_text = (
-        f"*RESQ ALERT*\nIncident: {incident_type}\nResource: {resource}\n"
-        f"Location: {location}\nTime: {timestamp}\n\n"
-        "Reply 'Confirm Dispatch' or 'Decline'."
+if DETECTOR_MODE == "process":
+    # --- Inference runs in detector_service.py; map its frames and state ---
+    for camera_id, source in VIDEO_SOURCES.items():
+        attach_remote_camera(register_camera(camera_id, source))
+else:
+    # --- Warm up the shared T5 model without blocking startup ---
+    if T5_WARMUP:
+        t5_generator.warm_up_async()
+
+    # --- Start Detector Engine ---
+    start_detector_engine(
+        video_sources=VIDEO_SOURCES,
+        model_dir="mobilenet",
+        conf_threshold=0.5
     )
-    # Try WhatsApp first
-    try:
-        msg = twilio_client.messages.create(
-            from_='whatsapp:+18777804236',
-            to=f'whatsapp:{to_number}',
-            body=body_text
-        )
-        print(f"WhatsApp message sent to {to_number}, SID: {getattr(msg, 'sid', None)}")
-        return getattr(msg, 'sid', None)
-    except Exception as e:
-        print(f"WhatsApp failed for {to_number}: {e}")
-        # Fallback to SMS
-        try:
-            msg_sms = twilio_client.messages.create(
-                from_=TWILIO_FROM_NUMBER,
-                to=to_number,
-                body=f"RESQ ALERT: Incident: {incident_type}, Resource: {resource}, Location: {location}, Time: {timestamp}"
-            )
-            print(f"SMS fallback sent to {to_number}, SID: {getattr(msg_sms, 'sid', None)}")
-            return getattr(msg_sms, 'sid', None)
-        except Exception as sms_e:
-            print(f"SMS fallback also failed for {to_number}: {sms_e}")
-            return None
 
-# --- Logging ---
-def log_incident(data):
-    if report_collection is not None:
-        doc = {
-            "detected_objects": data.get('objects_detected', []),
-            "objects_count": len(data.get('objects_detected', [])),
-            "object_person_count": data.get('objects_detected', []).count('person'),
-            "object_vehicle_count": data.get('objects_detected', []).count('vehicle'),
-            "gps": data.get('location_gps', {'lat': 0, 'lng': 0}),
-            "incident_type": data.get('incident_type', 'Unknown'),
-            "multi_incident_string": data.get('events', ''),
-            "report_text": data.get('final_report', ''),
-            "timestamp": datetime.now(),
-            "severity_level": data.get('severity_level', 3),
-            "dispatch_status": data.get('dispatch_status', {}),
-            "dispatch_state_snapshot": dispatch_state.copy(),
-            "events": data.get('events', []),
-            "resources_needed": data.get('resources_needed', [])
-        }
-        try:
-            report_collection.insert_one(doc)
-        except Exception as e:
-            print("Failed to insert into MongoDB:", e)
+# --- Dispatch runs in exactly one process ---
+# In process mode that is detector_service.py, and every web worker forwards
+# to it; each camera's dispatch state reaches them with that camera's state.
+DISPATCH_CONTROL_URL = f"http://{DISPATCH_CONTROL_HOST}:{DISPATCH_CONTROL_PORT}"
+if DETECTOR_MODE != "process":
+    dispatch_service.start(list(detector.CAMERAS.values()))
+
+def run_dispatch_action(action, camera_id):
+    """Run "auto", "send" or "cancel" for a camera where dispatch is owned; True if alerts were queued."""
+    if DETECTOR_MODE != "process":
+        return dispatch_service.run_action(action, camera_id)
+    response = requests.post(f"{DISPATCH_CONTROL_URL}/control/{action}", params={"camera": camera_id},
+                             timeout=DISPATCH_CONTROL_TIMEOUT)
+    response.raise_for_status()
+    return response.json()["queued"]
 
 # --- Allocate Resources ---
 def allocate_resources(events):
@@ -117,220 +64,218 @@ def allocate_resources(events):
                 resources.add(resource)
     return list(resources)
 
-# --- Core Dispatch (blocking) ---
-def perform_dispatch(now_data):
-    resources = now_data.get('resources_needed', [])
-    if not resources:
-        return False
-
-    sids = {}
-    all_receivers = []
-
-    for resource in resources:
-        receivers = RESOURCE_RECEIVERS.get(resource, [])
-        all_receivers.extend(receivers)
-        for number in receivers:
-            sid = send_message_with_fallback(
-                number,
-                resource,
-                now_data.get('incident_type', 'Unknown'),
-                now_data.get('location_gps', 'Unknown'),
-                now_data.get('timestamp', datetime.now().isoformat())
-            )
-            sids[number] = {"resource": resource, "sid": sid}
-
-    with STATE_LOCK:
-        dispatch_state['status'] = "Sent"
-        dispatch_state['timestamp'] = datetime.now().isoformat()
-        dispatch_state['receivers_map'] = {num: num for num in all_receivers}
-        dispatch_state['sids'] = sids
-        CURRENT_PREDICTION_DATA['dispatch_status'] = {
-            num: {"status": "Sent", "resources": [sids[num]['resource']], "sid": sids[num]}
-            for num in all_receivers
-        }
-
-    log_incident(CURRENT_PREDICTION_DATA)
-    return True
-
-# --- Core Dispatch (async wrapper) ---
-def perform_dispatch_async(now_data):
-    threading.Thread(target=perform_dispatch, args=(now_data,), daemon=True).start()
-
-# --- Cancel Dispatch ---
-def perform_cancel_dispatch():
-    default_numbers = list(dispatch_state.get('receivers_map', {}).keys())
-    if not default_numbers:
-        return False
-
-    cancel_sids = {}
-    any_sent = False
-    for number in default_numbers:
-        try:
-            msg_sid = send_message_with_fallback(
-                number,
-                "ALL",
-                "Incident Cancelled",
-                "N/A",
-                datetime.now().isoformat()
-            )
-            cancel_sids[number] = msg_sid
-            any_sent = True
-        except Exception as e:
-            print(f"Cancel message failed for {number}: {e}")
-            cancel_sids[number] = None
-
-    with STATE_LOCK:
-        dispatch_state['status'] = "Cancelled" if any_sent else dispatch_state.get('status', 'Failed')
-        dispatch_state['cancel_timestamp'] = datetime.now().isoformat()
-        dispatch_state['cancel_sids'] = cancel_sids
-        for num in default_numbers:
-            CURRENT_PREDICTION_DATA['dispatch_status'][num] = {
-                "status": "Cancelled",
-                "resources": CURRENT_PREDICTION_DATA.get('resources_needed', [])
-            }
+# --- Video Frame Generator (optimized) ---
+def _placeholder_jpeg():
+    frame = np.zeros((360, 640, 3), dtype=np.uint8)
+    cv2.putText(frame, "CAMERA INITIALIZING...", (20, 180),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+    return cv2.imencode('.jpg', frame)[1].tobytes()
 
-    log_incident(CURRENT_PREDICTION_DATA)
-    return any_sent
+PLACEHOLDER_JPEG = _placeholder_jpeg()
 
-# --- Video Frame Generator (optimized) ---
-def generate_frames():
+def generate_frames(camera, tier=DEFAULT_STREAM_TIER):
+    # Frames are encoded once per version by the camera's broadcaster and shared by all clients
+    version = 0
     while True:
-        with FRAME_LOCK:
-            frame = detector.CURRENT_FRAME.copy() if detector.CURRENT_FRAME is not None else np.zeros((360, 640, 3), dtype=np.uint8)
-        if frame is None:
-            cv2.putText(frame, "CAMERA INITIALIZING...", (20, 180),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-        ret, buffer = cv2.imencode('.jpg', frame)
+        version, jpeg = camera.broadcaster.wait_next(version, tier, timeout=1.0)
+        if jpeg is None:
+            if version:
+                continue
+            jpeg = PLACEHOLDER_JPEG
         yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + buffer.tobytes() + b'\r\n')
-        time.sleep(0.03)
+               b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
 
 # --- Flask Routes ---
+def _camera_or_404(camera_id):
+    camera = get_camera(camera_id)
+    if camera is None:
+        abort(404, description=f"Unknown camera: {camera_id}")
+    return camera
+
 @app.route('/')
 def index():
-    with STATE_LOCK:
-        events = CURRENT_PREDICTION_DATA.get('events', '')
+    camera = _camera_or_404(request.args.get('camera', DEFAULT_CAMERA_ID))
+    with camera.state_lock:
+        events = camera.prediction_data.get('events', '')
         events_list = [events] if isinstance(events, str) else events
-        CURRENT_PREDICTION_DATA['resources_needed'] = allocate_resources(events_list)
-    return render_template('index.html')
+        camera.prediction_data['resources_needed'] = allocate_resources(events_list)
+    return render_template('index.html', camera_id=camera.camera_id, camera_ids=detector.camera_ids())
 
 @app.route('/current_data')
-def current_data():
-    with STATE_LOCK:
-        events = CURRENT_PREDICTION_DATA.get('events', '')
+@app.route('/current_data/<camera_id>')
+def current_data(camera_id=DEFAULT_CAMERA_ID):
+    camera = _camera_or_404(camera_id)
+    with camera.state_lock:
+        events = camera.prediction_data.get('events', '')
         events_list = [events] if isinstance(events, str) else events
-        CURRENT_PREDICTION_DATA['resources_needed'] = allocate_resources(events_list)
-        data = CURRENT_PREDICTION_DATA.copy()
-        data['_dispatch_state'] = dispatch_state.copy()
+        camera.prediction_data['resources_needed'] = allocate_resources(events_list)
+        data = camera.prediction_data.copy()
     return jsonify(data)
 
+# --- Server-Sent Events state stream ---
+def generate_state_events(camera):
+    """Push a full snapshot first, then only the top-level fields that changed."""
+    version = -1
+    previous = None
+    while True:
+        version, data = camera.wait_for_change(version, timeout=15.0)
+        if data is None:
+            yield ": keepalive\n\n"
+            continue
+        if previous is None:
+            event, payload = "snapshot", data
+        else:
+            event = "diff"
+            payload = {key: value for key, value in data.items() if previous.get(key) != value}
+            removed = [key for key in previous if key not in data]
+            if removed:
+                payload['_removed'] = removed
+        previous = data
+        if payload:
+            yield f"id: {version}\nevent: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+
+@app.route('/stream')
+@app.route('/stream/<camera_id>')
+def state_stream(camera_id=DEFAULT_CAMERA_ID):
+    camera = _camera_or_404(camera_id)
+    return Response(
+        generate_state_events(camera),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def _dispatch_camera_id():
+    """The camera a dispatch form or call targets (`camera` field, default camera otherwise)."""
+    return _camera_or_404(request.values.get('camera', DEFAULT_CAMERA_ID)).camera_id
+
 @app.route('/auto_dispatch', methods=['POST'])
 def auto_dispatch():
-    with STATE_LOCK:
-        data = CURRENT_PREDICTION_DATA.copy()
-        perform_dispatch_async(data)  # Async call
-    return jsonify({"status": "dispatched"})
+    dispatched = run_dispatch_action("auto", _dispatch_camera_id())  # Only queues alerts
+    return jsonify({"status": "dispatched" if dispatched else "no new incidents"})
 
 @app.route('/video_feed')
-def video_feed():
-    return Response(generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+@app.route('/video_feed/<camera_id>')
+def video_feed(camera_id=DEFAULT_CAMERA_ID):
+    camera = _camera_or_404(camera_id)
+    tier = request.args.get('tier', DEFAULT_STREAM_TIER)
+    if tier not in STREAM_TIERS:
+        abort(400, description=f"Unknown stream tier: {tier}")
+    return Response(generate_frames(camera, tier), mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/send_dispatch', methods=['POST'])
 def send_dispatch():
-    with STATE_LOCK:
-        data = CURRENT_PREDICTION_DATA.copy()
+    camera_id = _dispatch_camera_id()
     try:
-        perform_dispatch_async(data)  # Async call
-        return redirect(url_for('index'))
+        run_dispatch_action("send", camera_id)  # Only queues alerts
+        return redirect(url_for('index', camera=camera_id))
     except Exception as e:
         print("send_dispatch error:", e)
-        return redirect(url_for('index'))
+        return redirect(url_for('index', camera=camera_id))
 
 @app.route('/cancel_dispatch', methods=['POST'])
 def cancel_dispatch():
+    camera_id = _dispatch_camera_id()
     try:
-        perform_cancel_dispatch()
+        run_dispatch_action("cancel", camera_id)
     except Exception as e:
         print("cancel_dispatch error:", e)
-    return redirect(url_for('index'))
+    return redirect(url_for('index', camera=camera_id))
 
 # --- Twilio Webhook for WhatsApp ---
 @app.route('/twilio_webhook', methods=['POST'])
 def twilio_webhook():
-    incoming_msg = request.form.get('Body', '').strip().lower()
-    from_number = request.form.get('From', '').replace(' ', '').replace('-', '')
-    response = MessagingResponse()
-
-    with STATE_LOCK:
-        dispatch_status_map = CURRENT_PREDICTION_DATA.get('dispatch_status', {})
-
-        matched_number = None
-        for num in dispatch_status_map.keys():
-            if num[-10:] == from_number[-10:]:
-                matched_number = num
-                break
-
-        if matched_number:
-            user_status = dispatch_status_map[matched_number].get('status', 'Sent')
-            resource = dispatch_status_map[matched_number]['resources'][0]
-
-            if 'confirm' in incoming_msg and user_status == 'Sent':
-                dispatch_status_map[matched_number]['status'] = 'Confirmed'
-                response.message("Thank you. Your dispatch status has been logged.")
-
-                # Notify others
-                for num, info in dispatch_status_map.items():
-                    if num != matched_number and info['resources'][0] == resource and info['status'] == 'Sent':
-                        try:
-                            send_message_with_fallback(num, resource, "No longer needed", "N/A", datetime.now().isoformat())
-                            info['status'] = 'Cancelled'
-                        except Exception as e:
-                            print(f"Failed to notify {num}: {e}")
-
-            elif 'decline' in incoming_msg and user_status == 'Sent':
-                dispatch_status_map[matched_number]['status'] = 'Declined'
-                response.message("You have declined the dispatch.")
-            else:
-                response.message("Your response cannot be processed. Dispatch already handled.")
-        else:
-            response.message("Your number is not recognized for any current dispatch.")
-
-        CURRENT_PREDICTION_DATA['dispatch_status'] = dispatch_status_map
-
-    log_incident(CURRENT_PREDICTION_DATA)
-    return str(response)
+    if DETECTOR_MODE != "process":
+        return dispatch_service.handle_reply(request.form.get('Body', ''), request.form.get('From', ''))
+    try:
+        response = requests.post(f"{DISPATCH_CONTROL_URL}/twilio_webhook", data=request.form,
+                                 timeout=DISPATCH_CONTROL_TIMEOUT)
+    except requests.RequestException as e:
+        print("twilio_webhook forward error:", e)
+        abort(502)  # Twilio retries the webhook
+    return Response(response.content, status=response.status_code, mimetype=response.headers.get('Content-Type'))
 
 @app.route('/receiver_location')
 def receiver_location():
-    with STATE_LOCK:
-        loc = CURRENT_PREDICTION_DATA.get('receiver_location', {'lat': 0, 'lng': 0})
+    camera = _camera_or_404(request.args.get('camera', DEFAULT_CAMERA_ID))
+    with camera.state_lock:
+        loc = camera.prediction_data.get('receiver_location', {'lat': 0, 'lng': 0})
     return jsonify(loc)
 
+def _parse_time_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f"Invalid '{name}' timestamp: {value}")
+
+def _history_page():
+    """Query one /history page from the request args; returns (incidents, next_cursor)."""
+    filters = {
+        "incident_type": request.args.get('type') or None,
+        "camera_id": request.args.get('camera') or None,
+        "since": _parse_time_arg('since'),
+        "until": _parse_time_arg('until'),
+    }
+    report_collection = get_collection()
+    if report_collection is None:
+        return [], None
+    try:
+        incidents, next_cursor = query_history(
+            report_collection,
+            limit=request.args.get('limit', HISTORY_PAGE_SIZE, type=int),
+            cursor=request.args.get('cursor'),
+            **filters
+        )
+    except ValueError as e:
+        abort(400, str(e))
+    return incidents, next_cursor
+
 @app.route('/history')
 def history():
-    incidents = []
-    if report_collection is not None:
-        incidents = list(report_collection.find().sort("timestamp", -1).limit(50))
-    return render_template("history.html", incidents=incidents)
-
-# --- Background Monitor (Single Incident) ---
-def _dispatch_monitor_loop():
-    print("Dispatch monitor started.")
-    while True:
-        try:
-            with STATE_LOCK:
-                now = CURRENT_PREDICTION_DATA.copy()
-            incident_type = now.get('incident_type', 'Normal Flow')
-            if incident_type and incident_type != "Normal Flow" and dispatch_state.get('status') != "Sent":
-                perform_dispatch_async(now)  # Async call
-            time.sleep(1.0)
-        except Exception as e:
-            print("Error in dispatch monitor loop:", e)
-            traceback.print_exc()
-            time.sleep(1.0)
-
-monitor_thread = threading.Thread(target=_dispatch_monitor_loop, daemon=True)
-monitor_thread.start()
+    incidents, next_cursor = _history_page()
+    return render_template("history.html", incidents=incidents, next_cursor=next_cursor,
+                           filters=request.args, camera_ids=detector.camera_ids())
+
+@app.route('/api/history')
+def history_api():
+    incidents, next_cursor = _history_page()
+    for incident in incidents:
+        incident['_id'] = str(incident['_id'])
+        if isinstance(incident.get('timestamp'), datetime):
+            incident['timestamp'] = incident['timestamp'].isoformat()
+    return jsonify({"incidents": incidents, "next_cursor": next_cursor})
+
+@app.route('/metrics')
+def metrics():
+    if not REGISTRY.enabled:
+        abort(404)
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/api/stats')
+def stats_api():
+    bucket = request.args.get('bucket', 'hour')
+    if bucket not in ('hour', 'day'):
+        abort(400, f"Unknown bucket: {bucket}")
+    until = _parse_time_arg('until')
+    since = _parse_time_arg('since') or (until or datetime.now()) - timedelta(hours=STATS_DEFAULT_RANGE_HOURS[bucket])
+    filters = {
+        "incident_type": request.args.get('type') or None,
+        "camera_id": request.args.get('camera') or None,
+    }
+    counts = INCIDENT_ROLLUPS.incident_counts(bucket, since=since, until=until, **filters)
+    dispatched = INCIDENT_ROLLUPS.incident_counts(bucket, since=since, until=until, kind=ROLLUP_DISPATCHED, **filters)
+    for row in counts + dispatched:
+        row['start'] = row['start'].isoformat()
+    return jsonify({
+        "bucket": bucket,
+        "since": since.isoformat(),
+        "until": until.isoformat() if until else None,
+        "counts": counts,
+        "dispatched": dispatched,
+        "confirmation_latency": INCIDENT_ROLLUPS.confirmation_latency(since=since, until=until)
+    })
 
 if __name__ == "__main__":
     app.run(host=FLASK_HOST, port=FLASK_PORT, debug=True, use_reloader=False, threaded=True)
@@ -0,0 +1,288 @@
+# benchmark.py
+# Offline replay benchmark for the detection pipeline and the incident classifier.
+#
+#   python benchmark.py pipeline path/to/video.mp4
+#   python benchmark.py pipeline path/to/frames/ --reports mock
+#   python benchmark.py pipeline synthetic:500 --detector synthetic
+#   python benchmark.py classify --boxes 10 50 200 1000
+#
+# Frames are processed back to back (no capture thread, no pacing). T5 is
+# replaced by a canned report generator unless --reports t5 is given; the
+# pipeline never touches Twilio or MongoDB.
+import os
+import sys
+import json
+import time
+import argparse
+import contextlib
+from collections import defaultdict
+import numpy as np
+import cv2
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+# --- Measurement ---
+class StageTimer:
+    """Collects wall-clock samples per named stage (seconds)."""
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - start)
+
+    def summary(self):
+        return {name: latency_summary(values) for name, values in self.samples.items()}
+
+def latency_summary(values):
+    ms = np.asarray(values, dtype=np.float64) * 1000.0
+    return {
+        "count": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (None where unsupported)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # KB on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def print_table(title, rows):
+    print(f"\n{title}")
+    print(f"{'stage':<14}{'count':>8}{'mean':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}  (ms)")
+    for name, s in rows.items():
+        print(f"{name:<14}{s['count']:>8}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}"
+              f"{s['p90_ms']:>10.2f}{s['p99_ms']:>10.2f}{s['max_ms']:>10.2f}")
+
+# --- Synthetic scenes ---
+def synthetic_boxes(rng, n, min_size=0.03, max_size=0.15):
+    """`n` random normalised [x1, y1, x2, y2] boxes."""
+    size = rng.uniform(min_size, max_size, size=(n, 2))
+    origin = rng.uniform(0, 1, size=(n, 2)) * (1 - size)
+    return np.concatenate([origin, origin + size], axis=1)
+
+def synthetic_scene(rng, n_boxes, person_ratio=0.2, obstacle_ratio=0.1, fire=True):
+    """
+    Dense classifier input: (detected_objects, vehicle_boxes, obstacle_boxes, fire_boxes)
+    in the shapes produced by detector._split_detections and fire.FireDetector.
+    """
+    from main import VEHICLE_CLASSES, OBSTACLE_CLASSES
+    boxes = synthetic_boxes(rng, n_boxes).tolist()
+    n_obstacles = int(n_boxes * obstacle_ratio)
+    n_people = int(n_boxes * person_ratio)
+    detected_objects, vehicle_boxes, obstacle_boxes = [], [], []
+    for i, box in enumerate(boxes):
+        if i < n_obstacles:
+            cls = OBSTACLE_CLASSES[i % len(OBSTACLE_CLASSES)]
+            obstacle_boxes.append(box)
+        else:
+            cls = 'person' if i < n_obstacles + n_people else VEHICLE_CLASSES[i % len(VEHICLE_CLASSES)]
+            vehicle_boxes.append({'box': box, 'class': cls, 'track_id': i})
+        detected_objects.append(cls)
+    fire_boxes = [[10, 10, 60, 60]] if fire else []
+    return detected_objects, vehicle_boxes, obstacle_boxes, fire_boxes
+
+def synthetic_frame(rng, width=1280, height=720, n_objects=20, fire=True):
+    """A BGR frame with random coloured rectangles and (optionally) a flame-coloured blob."""
+    frame = np.full((height, width, 3), 60, dtype=np.uint8)
+    for x1, y1, x2, y2 in synthetic_boxes(rng, n_objects) * [width, height, width, height]:
+        color = tuple(int(c) for c in rng.integers(0, 256, size=3))
+        cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), color, -1)
+    if fire:
+        cx, cy = int(rng.uniform(0.2, 0.8) * width), int(rng.uniform(0.2, 0.8) * height)
+        cv2.circle(frame, (cx, cy), max(20, width // 30), (0, 165, 255), -1)  # BGR orange
+    return frame
+
+class SyntheticModels:
+    """Stands in for detector.DetectorModels: random SSD-shaped output, no model files needed."""
+    def __init__(self, n_objects=20, seed=0):
+        from detector import MOBILENET_CLASSES
+        self.n_objects = n_objects
+        self.rng = np.random.default_rng(seed)
+        self.class_ids = [MOBILENET_CLASSES.index(c) for c in ('car', 'bus', 'person', 'motorbike', 'chair')]
+        self.net_yolo = None
+        self.yolo_mode = "off"
+
+    def detect_mobilenet_many(self, frames, size=300):
+        return [self.detect_mobilenet(frame) for frame in frames]
+
+    def detect_mobilenet(self, frame, size=300):
+        out = np.zeros((1, 1, self.n_objects, 7), dtype=np.float32)
+        out[0, 0, :, 1] = self.rng.choice(self.class_ids, size=self.n_objects)
+        out[0, 0, :, 2] = self.rng.uniform(0.3, 1.0, size=self.n_objects)
+        out[0, 0, :, 3:7] = synthetic_boxes(self.rng, self.n_objects)
+        return out
+
+# --- Frame sources ---
+def iter_frames(source, limit=None, seed=0):
+    """Frames from a video file, an image directory, or 'synthetic:N'."""
+    count = 0
+    if source.startswith('synthetic:'):
+        rng = np.random.default_rng(seed)
+        total = int(source.split(':', 1)[1])
+        for _ in range(total if limit is None else min(total, limit)):
+            yield synthetic_frame(rng)
+        return
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            if limit is not None and count >= limit:
+                return
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                frame = cv2.imread(os.path.join(source, name))
+                if frame is not None:
+                    count += 1
+                    yield frame
+        return
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise SystemExit(f"Cannot open video source: {source}")
+    try:
+        while limit is None or count < limit:
+            ret, frame = cap.read()
+            if not ret:
+                return
+            count += 1
+            yield frame
+    finally:
+        cap.release()
+
+# --- Report generation ---
+def mock_generate_batch(latency):
+    def generate(incidents):
+        if latency:
+            time.sleep(latency)
+        return [f"[mock report] {inc.get('incident_type', 'Unknown')} incident." for inc in incidents]
+    return generate
+
+def make_report_service(mode, mock_latency, timer):
+    from report_service import ReportService
+    if mode == 't5':
+        from t5_generator import generate_reports_batch as generate
+    elif mode == 'mock':
+        generate = mock_generate_batch(mock_latency)
+    else:
+        generate = lambda incidents: [""] * len(incidents)
+
+    def timed_generate(incidents):
+        # Runs on the report worker thread, off the frame path
+        with timer.stage("report_gen"):
+            return generate(incidents)
+    return ReportService(generate_batch_fn=timed_generate)
+
+# --- Commands ---
+def run_pipeline(args):
+    import detector
+    from detector import CameraState, DetectorModels, _analyze_frame
+    from profiles import CameraProfile
+
+    timer = StageTimer()
+    detector.REPORT_SERVICE = make_report_service(args.reports, args.mock_report_latency, timer)
+    if args.detector == 'synthetic':
+        models = SyntheticModels(n_objects=args.objects, seed=args.seed)
+    else:
+        models = DetectorModels(args.model_dir, yolo_mode=args.yolo, batch_size=1)
+    camera = CameraState("bench", args.source)
+    cols, _, rows = args.tiles.partition('x')
+    camera.profile = CameraProfile(input_size=args.input_size, tiles=(int(cols), int(rows or 1)))
+    tier = args.tier
+
+    frames = iter_frames(args.source, args.limit, args.seed)
+    processed = 0
+    rss_before = peak_rss_mb()
+    start = time.perf_counter()
+    while True:
+        with timer.stage("read"):
+            frame = next(frames, None)
+        if frame is None:
+            break
+        with timer.stage("total"):
+            _analyze_frame(camera, frame, models, args.conf, detect_every=args.detect_every, timer=timer)
+            with timer.stage("encode"):
+                camera.broadcaster.wait_next(camera.broadcaster.version - 1, tier, timeout=0)
+        processed += 1
+    elapsed = time.perf_counter() - start
+
+    result = {
+        "source": args.source,
+        "detector": args.detector,
+        "frames": processed,
+        "seconds": elapsed,
+        "fps": processed / elapsed if elapsed > 0 else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "peak_rss_mb_before": rss_before,
+        "stages": timer.summary(),
+        "motion_skipped": camera.motion_gate.skipped if camera.motion_gate is not None else 0,
+    }
+    if not processed:
+        raise SystemExit(f"No frames read from {args.source}")
+    print_table(f"Pipeline: {processed} frames in {elapsed:.2f}s = {result['fps']:.1f} FPS, "
+                f"peak RSS {result['peak_rss_mb'] or 0:.0f} MB", result["stages"])
+    return result
+
+def run_classify(args):
+    from main import classify_incident, IncidentTracker
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    for n in args.boxes:
+        scenes = [synthetic_scene(rng, n) for _ in range(min(args.iterations, 32))]
+        tracker = IncidentTracker()
+        samples = []
+        for i in range(args.iterations):
+            detected_objects, vehicle_boxes, obstacle_boxes, fire_boxes = scenes[i % len(scenes)]
+            start = time.perf_counter()
+            classify_incident(detected_objects, vehicle_boxes, obstacle_boxes, fire_boxes, tracker=tracker)
+            samples.append(time.perf_counter() - start)
+        results[f"{n} boxes"] = latency_summary(samples)
+    print_table(f"classify_incident ({args.iterations} iterations per size)", results)
+    return {"classify": results, "peak_rss_mb": peak_rss_mb()}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark for the ResQ detection pipeline.")
+    parser.add_argument('--json', help="Also write results to this JSON file")
+    parser.add_argument('--seed', type=int, default=0)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    pipeline = commands.add_parser('pipeline', help="Replay frames through the full per-frame pipeline")
+    pipeline.add_argument('source', help="Video file, image directory, or synthetic:N")
+    pipeline.add_argument('--limit', type=int, help="Stop after this many frames")
+    pipeline.add_argument('--detector', choices=['mobilenet', 'synthetic'], default='mobilenet')
+    pipeline.add_argument('--model-dir', default='mobilenet')
+    pipeline.add_argument('--yolo', choices=['off', 'always', 'cascade'], default='off',
+                          help="Also run YOLOv8 (requires ultralytics)")
+    pipeline.add_argument('--objects', type=int, default=20, help="Detections per frame for --detector synthetic")
+    pipeline.add_argument('--conf', type=float, default=0.5)
+    pipeline.add_argument('--detect-every', type=int, default=1,
+                          help="Run the detector every N frames (the live default is DETECT_EVERY_N_FRAMES)")
+    pipeline.add_argument('--input-size', type=int, default=300, help="MobileNet input side")
+    pipeline.add_argument('--tiles', default='1x1', help="Detect on COLSxROWS overlapping tiles")
+    pipeline.add_argument('--reports', choices=['off', 'mock', 't5'], default='mock')
+    pipeline.add_argument('--mock-report-latency', type=float, default=0.0, help="Seconds per mocked report batch")
+    pipeline.add_argument('--tier', default='high', help="Stream tier to JPEG-encode each frame at")
+    pipeline.set_defaults(run=run_pipeline)
+
+    classify = commands.add_parser('classify', help="Time classify_incident on synthetic dense scenes")
+    classify.add_argument('--boxes', type=int, nargs='+', default=[10, 50, 200, 1000])
+    classify.add_argument('--iterations', type=int, default=200)
+    classify.set_defaults(run=run_classify)
+
+    args = parser.parse_args(argv)
+    result = args.run(args)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# capture.py
+# One capture thread per video source, always holding the freshest frame.
+import time
+import threading
+from collections import deque
+import cv2
+from metrics import REGISTRY
+from config import CAPTURE_BUFFER_SIZE, CAPTURE_RECONNECT_MIN, CAPTURE_RECONNECT_MAX, CAPTURE_MAX_READ_FAILURES
+
+READ_SECONDS = REGISTRY.histogram("resq_capture_read_seconds", "Time per VideoCapture.read() call.")
+
+class FrameSource:
+    """
+    Reads `video_source` continuously on a background thread into a small
+    drop-oldest ring buffer, so consumers never see frames queued up in
+    OpenCV's own buffer. Dropped streams are reopened with exponential backoff.
+    """
+    def __init__(self, video_source, buffer_size=CAPTURE_BUFFER_SIZE, name=None):
+        self.video_source = video_source
+        self.name = name or str(video_source)
+        self._buffer = deque(maxlen=max(1, buffer_size))
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self.connected = False
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.reconnects = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"capture-{self.name}", daemon=True)
+            self._thread.start()
+        return self
+
+    @property
+    def started(self):
+        return self._thread is not None
+
+    def stop(self):
+        self._stopped.set()
+
+    def latest(self):
+        """
+        Return (seq, frame) for the newest captured frame and clear the buffer,
+        or (None, None) if nothing new has arrived since the last call.
+        """
+        with self._lock:
+            if not self._buffer:
+                return None, None
+            seq, frame = self._buffer[-1]
+            self.frames_dropped += len(self._buffer) - 1
+            self._buffer.clear()
+        return seq, frame
+
+    def _push(self, frame):
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.frames_dropped += 1
+            self._seq += 1
+            self._buffer.append((self._seq, frame))
+            self.frames_captured += 1
+
+    def _run(self):
+        backoff = CAPTURE_RECONNECT_MIN
+        while not self._stopped.is_set():
+            cap = cv2.VideoCapture(self.video_source)
+            if not cap.isOpened():
+                print(f"Video source {self.video_source} not available, retrying in {backoff:.1f}s.")
+                cap.release()
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, CAPTURE_RECONNECT_MAX)
+                continue
+
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            self.connected = True
+            backoff = CAPTURE_RECONNECT_MIN
+            failures = 0
+            while not self._stopped.is_set():
+                with READ_SECONDS.time(source=self.name):
+                    ret, frame = cap.read()
+                if not ret:
+                    failures += 1
+                    if failures >= CAPTURE_MAX_READ_FAILURES:
+                        break
+                    time.sleep(0.01)
+                    continue
+                failures = 0
+                self._push(frame)
+
+            cap.release()
+            self.connected = False
+            if not self._stopped.is_set():
+                print(f"Video source {self.video_source} dropped, reconnecting in {backoff:.1f}s.")
+                self.reconnects += 1
+                self._stopped.wait(backoff)
+                backoff = min(backoff * 2, CAPTURE_RECONNECT_MAX)
@@ -5,19 +5,163 @@
 TWILIO_ACCOUNT_SID = "your_account_sid"
 TWILIO_AUTH_TOKEN = "your_auth_token"
 TWILIO_FROM_NUMBER = "your_from_number"  # Twilio virtual number
+TWILIO_WHATSAPP_FROM = "whatsapp:+18777804236"  # Twilio WhatsApp sender
+# Override the Twilio API base URL (e.g. "http://127.0.0.1:8099" for a local fake endpoint)
+TWILIO_API_BASE_URL = None
+
+# Alert fan-out: concurrent sends over one pooled HTTP client
+DISPATCH_WORKERS = 16
+DISPATCH_MAX_RETRIES = 3
+DISPATCH_RETRY_BASE_DELAY = 0.5  # seconds, doubled per retry
+DISPATCH_RATE_PER_SECOND = 20  # max Twilio API calls per second (0 = unlimited)
+DISPATCH_HTTP_TIMEOUT = 10.0
+DISPATCH_DEFAULT_COUNTRY_CODE = "91"  # for receiver numbers stored without a '+' prefix
+# An incident must stay active this long before it is auto-dispatched (once per incident)
+DISPATCH_DEBOUNCE_SECONDS = 2.0
+# Dispatch state for an incident is dropped after it has not been seen for this long
+DISPATCH_FORGET_SECONDS = 600.0
+
+# Durable alert outbox (SQLite, WAL): alerts survive restarts and provider outages
+OUTBOX_PATH = "outbox.db"
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_RETRY_BASE_DELAY = 2.0  # seconds, doubled per failed attempt
+OUTBOX_POLL_INTERVAL = 1.0
+OUTBOX_CLAIM_TIMEOUT = 120.0  # seconds before a row stuck in 'sending' (crashed sender) is retried
 
 # MongoDB (Atlas) connection string (use srv or non-srv)
 MONGO_URI = "your_uri"
 MONGO_DB_NAME = "resq"
-MONGO_COLLECTION = "reports"
+MONGO_COLLECTION = "report"  # the collection app.py has always logged to
+MONGO_TIMEOUT_MS = 5000
+
+# Incident logging: batched background writes, spilled to disk while MongoDB is down
+LOG_BATCH_SIZE = 100
+LOG_FLUSH_INTERVAL = 1.0  # seconds
+LOG_BUFFER_MAX = 10000  # documents held in memory before spilling
+LOG_SPILL_PATH = "incident_log_spill.jsonl"
+LOG_RETRY_INTERVAL = 5.0  # seconds between reconnect/replay attempts
+
+# /history pagination
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+
+# Incident statistics (pre-aggregated rollups)
+MONGO_ROLLUP_COLLECTION = "incident_rollups"
+# One document per incident the tracker opens; incident counts are rolled up from these
+MONGO_ACTIVATION_COLLECTION = "incident_activations"
+ACTIVATION_SPILL_PATH = "incident_activation_spill.jsonl"
+LATENCY_BUCKETS = [5, 10, 20, 30, 60, 120, 300, 600, 1200, 1800, 3600]  # seconds, confirmation latency histogram
+STATS_DEFAULT_RANGE_HOURS = {"hour": 24, "day": 24 * 30}  # /api/stats window when ?since= is omitted
 
 # T5 Model ('t5-small' or path to local checkpoint)
 T5_MODEL_NAME = "t5-small"
+# T5 inference backend: "torch", "int8" (dynamic int8 quantization) or "onnx" (needs optimum[onnxruntime])
+T5_BACKEND = "torch"
+# Where the "onnx" backend keeps its exported model, so it is only exported on the first start
+T5_ONNX_CACHE_DIR = "t5_onnx"
+# Load and warm up T5 in the background at startup (otherwise on first report)
+T5_WARMUP = True
+# Number of individual incident reports kept in the report service's LRU cache
+REPORT_CACHE_SIZE = 128
 
 # Video source:
 VIDEO_SOURCE = 0 # local webcam
 # "http://<ip>:8080/video" or RTSP URL
 
+# Cameras: camera id -> video source. All cameras share one loaded model
+# and are scheduled across DETECTOR_WORKERS threads.
+VIDEO_SOURCES = {
+    "cam0": VIDEO_SOURCE,
+}
+DEFAULT_CAMERA_ID = "cam0"
+DETECTOR_WORKERS = 4
+
+# MobileNet batching: frames from concurrent workers are grouped into one
+# forward pass of up to MOBILENET_BATCH_SIZE, waiting at most MOBILENET_BATCH_WAIT s.
+# The wait ends early once every camera that can be in flight (with all its tiles) has submitted.
+# Set MOBILENET_BATCH_SIZE = 1 to disable.
+MOBILENET_BATCH_SIZE = 8
+MOBILENET_BATCH_WAIT = 0.01
+
+# Object detector input: MobileNet input side, and the overlap between tiles
+# for cameras split into several tiles (see CAMERA_PROFILES)
+DETECT_INPUT_SIZE = 300
+DETECT_TILE_OVERLAP = 0.1
+# Duplicate boxes of the same class (tile seams) above this IoU are merged
+DETECT_NMS_IOU = 0.5
+
+# YOLOv8 (requires ultralytics) next to MobileNet: "off", "always" (every
+# detection pass) or "cascade" (only when MobileNet has vehicle, person or
+# obstacle boxes between CASCADE_MIN_CONF and the detection threshold, or a
+# crash/jam/person-hit incident is pending or active on the camera). Boxes from both models are
+# fused with the same per-class NMS as tiles (DETECT_NMS_IOU).
+YOLO_MODE = "off"
+YOLO_CONF = 0.4
+CASCADE_MIN_CONF = 0.25
+# Margin (fraction of the frame) around uncertain boxes for a cascade-only YOLO crop
+CASCADE_MARGIN = 0.1
+
+# Per-camera analysis profiles: camera id -> settings, all optional.
+#   "roi": polygons of [x, y] points normalised to 0..1; the detector only sees
+#          these areas, and detections outside them never reach classification
+#   "input_size": MobileNet input side for this camera (default DETECT_INPUT_SIZE)
+#   "tiles": [columns, rows] to detect on overlapping tiles, for distant high-res cameras
+# e.g. "cam0": {"roi": [[[0.0, 0.4], [1.0, 0.4], [1.0, 1.0], [0.0, 1.0]]], "tiles": [2, 1]}
+CAMERA_PROFILES = {}
+
+# Run the object detector on every Nth frame and track boxes in between (1 = every frame)
+DETECT_EVERY_N_FRAMES = 3
+
+# Capture: each source is read on its own thread into a drop-oldest buffer;
+# dropped streams are reopened with exponential backoff.
+CAPTURE_BUFFER_SIZE = 2
+CAPTURE_RECONNECT_MIN = 0.5
+CAPTURE_RECONNECT_MAX = 30.0
+CAPTURE_MAX_READ_FAILURES = 50
+CAPTURE_POLL_INTERVAL = 0.01
+# Analysis rate per camera (frames per second)
+TARGET_FPS = 12
+
+# MJPEG streaming tiers for /video_feed?tier=<name>: each new frame is encoded
+# once per tier and shared by every connected client.
+STREAM_TIERS = {
+    "high": {"quality": 80, "max_width": 800},
+    "low": {"quality": 50, "max_width": 480},
+}
+DEFAULT_STREAM_TIER = "high"
+
+# Detector placement: "thread" runs inference inside the web process; "process"
+# expects `python detector_service.py` and reads its frames/state from shared memory
+DETECTOR_MODE = "thread"
+SHARED_FRAME_SLOTS = 4
+SHARED_FRAME_MAX_WIDTH = 800  # published frames are already scaled to <= 800 px wide
+SHARED_FRAME_MAX_HEIGHT = 800
+SHARED_STATE_BYTES = 256 * 1024
+SHARED_POLL_INTERVAL = 0.01  # seconds between web-worker checks for new frames/state
+# In process mode the detector process also owns dispatch (outbox, responder
+# replies, auto-dispatch) and pipeline metrics, served on this local address;
+# web workers forward dispatch actions and the Twilio webhook to it
+DISPATCH_CONTROL_HOST = "127.0.0.1"
+DISPATCH_CONTROL_PORT = 5001
+DISPATCH_CONTROL_TIMEOUT = 10.0
+
+# Motion gate: near-identical frames reuse the previous detections
+MOTION_GATE_ENABLED = True
+MOTION_WIDTH = 160  # pixels; frames are compared at this width in grayscale
+MOTION_PIXEL_THRESHOLD = 25  # grey-level change for a pixel to count as changed
+MOTION_MIN_CHANGED_RATIO = 0.002  # fraction of changed pixels that triggers analysis
+MOTION_REFRESH_SECONDS = 2.0  # full analysis at least this often regardless of motion
+
+# Fire detection: HSV mask on a downscaled frame, confirmed over time
+FIRE_DETECT_WIDTH = 320  # pixels; frames are shrunk to this width first
+FIRE_MIN_AREA_RATIO = 0.0013  # smallest region as a fraction of the frame (~400 px at 640x480)
+FIRE_WINDOW = 8  # frames of history
+FIRE_MIN_HITS = 5  # frames with fire-coloured area needed within the window
+FIRE_MIN_FLICKER = 0.05  # minimum std/mean of that area across those frames
+
+# Metrics (/metrics, Prometheus text format); when False, timers and counters are no-ops
+METRICS_ENABLED = True
+
 # Flask settings
 FLASK_HOST = "0.0.0.0"
 FLASK_PORT = 5000
@@ -1,19 +1,280 @@
 # db_utils.py
-from pymongo import MongoClient
-from config import MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION
+# Shared MongoDB connection and a batched, non-blocking incident log writer.
+import os
+import time
+import atexit
+import threading
+from datetime import datetime
+from collections import deque
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+from bson import json_util, ObjectId
+from metrics import REGISTRY
+from config import (
+    MONGO_URI, MONGO_DB_NAME, MONGO_COLLECTION, MONGO_TIMEOUT_MS,
+    LOG_BATCH_SIZE, LOG_FLUSH_INTERVAL, LOG_BUFFER_MAX, LOG_SPILL_PATH, LOG_RETRY_INTERVAL,
+    HISTORY_PAGE_SIZE, HISTORY_MAX_PAGE_SIZE, MONGO_ACTIVATION_COLLECTION, ACTIVATION_SPILL_PATH
+)
+
+DUPLICATE_KEY_ERROR = 11000
+
+INSERT_SECONDS = REGISTRY.histogram("resq_mongo_insert_seconds", "insert_many round trip per incident log batch.")
 
 _client = None
-_db = None
+_database = None
 _collection = None
+_client_lock = threading.Lock()
+_last_attempt = 0.0
 
-def _get_collection():
-    global _client, _db, _collection
-    if _collection is None:
-        _client = MongoClient(MONGO_URI)
-        _db = _client[MONGO_DB_NAME]
-        _collection = _db[MONGO_COLLECTION]
+def get_collection():
+    """
+    The reports collection on the shared client, or None while MongoDB is
+    unreachable (reconnects are attempted at most every LOG_RETRY_INTERVAL).
+    """
+    global _client, _database, _collection, _last_attempt
+    if _collection is not None:
+        return _collection
+    with _client_lock:
+        if _collection is None and time.monotonic() - _last_attempt >= LOG_RETRY_INTERVAL:
+            _last_attempt = time.monotonic()
+            try:
+                client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=MONGO_TIMEOUT_MS)
+                client.server_info()
+                database = client[MONGO_DB_NAME]
+                collection = database[MONGO_COLLECTION]
+                ensure_indexes(collection)
+                _client, _database = client, database
+                _collection = collection
+            except Exception as e:
+                print("MongoDB connection failed:", e)
     return _collection
 
+def get_database():
+    """The shared database, or None while MongoDB is unreachable."""
+    return _database if get_collection() is not None else None
+
+def get_activation_collection():
+    """The incident activations collection, or None while MongoDB is unreachable."""
+    database = get_database()
+    return database[MONGO_ACTIVATION_COLLECTION] if database is not None else None
+
+# --- History queries ---
+# Newest first; _id breaks ties between documents logged in the same millisecond
+HISTORY_SORT = [("timestamp", DESCENDING), ("_id", DESCENDING)]
+
+# Fields needed by the history list (skips report_text, dispatch_state_snapshot, ...)
+HISTORY_PROJECTION = {
+    "incident_type": 1, "incident_types": 1, "camera_id": 1, "timestamp": 1, "gps": 1,
+    "severity_level": 1, "resources_needed": 1, "dispatch_status": 1
+}
+
+def ensure_indexes(collection):
+    """Indexes backing the history list and its filters (no-op if they already exist)."""
+    collection.create_index(HISTORY_SORT, name="timestamp_desc")
+    collection.create_index([("incident_types", ASCENDING)] + HISTORY_SORT, name="type_timestamp")
+    # Documents logged before incident_types existed only carry incident_type
+    collection.create_index([("incident_type", ASCENDING)] + HISTORY_SORT, name="legacy_type_timestamp")
+    collection.create_index([("camera_id", ASCENDING)] + HISTORY_SORT, name="camera_timestamp")
+
+def encode_cursor(doc):
+    return f"{doc['timestamp'].isoformat()}_{doc['_id']}"
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor."""
+    timestamp, _, oid = cursor.rpartition('_')
+    try:
+        return datetime.fromisoformat(timestamp), ObjectId(oid)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+def query_history(collection, limit=HISTORY_PAGE_SIZE, cursor=None, incident_type=None,
+                  camera_id=None, since=None, until=None):
+    """
+    One page of logged incidents, newest first, using keyset pagination on
+    (timestamp, _id). `since`/`until` are datetimes. Returns
+    (documents, next_cursor); next_cursor is None on the last page.
+    """
+    limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+    clauses = []
+    if incident_type:
+        # Each branch is served by its own index and the results merged in sort order
+        clauses.append({"$or": [{"incident_types": incident_type}, {"incident_type": incident_type}]})
+    if camera_id:
+        clauses.append({"camera_id": camera_id})
+    time_range = {}
+    if since is not None:
+        time_range["$gte"] = since
+    if until is not None:
+        time_range["$lt"] = until
+    if time_range:
+        clauses.append({"timestamp": time_range})
+    if cursor:
+        timestamp, oid = decode_cursor(cursor)
+        clauses.append({"$or": [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": oid}}
+        ]})
+    query = {"$and": clauses} if clauses else {}
+    # One extra document tells us whether another page exists
+    docs = list(collection.find(query, HISTORY_PROJECTION).sort(HISTORY_SORT).limit(limit + 1))
+    next_cursor = encode_cursor(docs[limit - 1]) if len(docs) > limit else None
+    return docs[:limit], next_cursor
+
+class IncidentLogWriter:
+    """
+    Buffers documents in memory and writes them with `insert_many` from a
+    background thread once LOG_BATCH_SIZE documents are waiting or
+    LOG_FLUSH_INTERVAL has passed. `log()` never touches the network.
+
+    When MongoDB is down (or the buffer is full) documents are appended to a
+    JSON-lines spill file, which is replayed once writes succeed again.
+    Every document gets its `_id` before its first write, so a replayed
+    batch that was partly stored is deduplicated by MongoDB. Callbacks in
+    `on_written` may therefore see a document more than once.
+    """
+    def __init__(self, collection_fn=get_collection, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, max_buffer=LOG_BUFFER_MAX, spill_path=LOG_SPILL_PATH,
+                 name="incident-log"):
+        self.collection_fn = collection_fn
+        self.name = name
+        self.on_written = []  # callbacks(docs) run on the writer thread after each stored batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self._buffer = deque()
+        self._max_buffer = max_buffer
+        self._cond = threading.Condition()
+        self._spill_lock = threading.Lock()
+        self._writing = False
+        self._retry_at = 0.0
+        self._thread = None
+        self.written = 0
+        self.spilled = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            atexit.register(self.flush, 5.0)
+        return self
+
+    def log(self, doc):
+        """Queue `doc` for writing; returns immediately."""
+        doc.setdefault('_id', ObjectId())
+        with self._cond:
+            if len(self._buffer) < self._max_buffer:
+                self._buffer.append(doc)
+                if len(self._buffer) >= self.batch_size:
+                    self._cond.notify()
+                return
+        # Backpressure without blocking the caller: overflow goes to disk
+        self._spill([doc])
+
+    def flush(self, timeout=None):
+        """Wait until the buffer has been written (or spilled). Returns True if it drained."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify()
+            while self._buffer or self._writing:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining if remaining is not None else self.flush_interval)
+        return True
+
+    def pending(self):
+        with self._cond:
+            return len(self._buffer)
+
+    def _take_batch(self):
+        with self._cond:
+            if len(self._buffer) < self.batch_size:
+                self._cond.wait(self.flush_interval)
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            self._writing = bool(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            try:
+                if batch and not self._write(batch):
+                    self._spill(batch)
+                if self._has_spill():
+                    self._replay_spill()
+            except Exception as e:
+                print("Incident log writer error:", e)
+            finally:
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+
+    def _write(self, docs):
+        """insert_many `docs`; returns False if they could not be stored."""
+        if time.monotonic() < self._retry_at:
+            return False
+        collection = self.collection_fn()
+        if collection is None:
+            self._retry_at = time.monotonic() + LOG_RETRY_INTERVAL
+            return False
+        try:
+            with INSERT_SECONDS.time():
+                collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Duplicates were stored by an earlier attempt; anything else goes to disk
+            failed = [docs[err['index']] for err in e.details.get('writeErrors', [])
+                      if err.get('code') != DUPLICATE_KEY_ERROR]
+            if failed:
+                self._spill(failed)
+        except Exception as e:
+            print("Failed to insert into MongoDB:", e)
+            self._retry_at = time.monotonic() + LOG_RETRY_INTERVAL
+            return False
+        self.written += len(docs)
+        for callback in self.on_written:
+            try:
+                callback(docs)
+            except Exception as e:
+                print("Incident log callback error:", e)
+        return True
+
+    def _spill(self, docs):
+        with self._spill_lock:
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for doc in docs:
+                    f.write(json_util.dumps(doc) + "\n")
+        self.spilled += len(docs)
+
+    def _has_spill(self):
+        return os.path.exists(self.spill_path) or os.path.exists(self.spill_path + ".replay")
+
+    def _replay_spill(self):
+        if time.monotonic() < self._retry_at:
+            return
+        replay_path = self.spill_path + ".replay"
+        # A leftover replay file (crash mid-replay) is finished first
+        with self._spill_lock:
+            if not os.path.exists(replay_path):
+                os.replace(self.spill_path, replay_path)
+        with open(replay_path, encoding='utf-8') as f:
+            docs = [json_util.loads(line) for line in f if line.strip()]
+        for i in range(0, len(docs), self.batch_size):
+            if not self._write(docs[i:i + self.batch_size]):
+                # Still unavailable: keep the rest for the next attempt
+                self._spill(docs[i:])
+                break
+        os.remove(replay_path)
+
+INCIDENT_LOG = IncidentLogWriter().start()
+REGISTRY.collector("resq_incident_log_buffered", "Incident documents waiting to be written.", INCIDENT_LOG.pending)
+REGISTRY.collector("resq_incident_log_written_total", "Incident documents stored in MongoDB.",
+                   lambda: INCIDENT_LOG.written, "counter")
+REGISTRY.collector("resq_incident_log_spilled_total", "Incident documents spilled to disk.",
+                   lambda: INCIDENT_LOG.spilled, "counter")
+
+# Incidents as the trackers open them, one document per activation
+ACTIVATION_LOG = IncidentLogWriter(get_activation_collection, spill_path=ACTIVATION_SPILL_PATH,
+                                   name="activation-log").start()
+
 def log_report_to_db(report_doc):
-    coll = _get_collection()
-    coll.insert_one(report_doc)
+    INCIDENT_LOG.log(report_doc)
@@ -1,26 +1,25 @@
 import time
+import copy
+import heapq
+import queue
 import threading
+from concurrent.futures import Future
 import numpy as np
 import cv2
-from t5_generator import generate_report_from_incident
-from config import VIDEO_SOURCE
-
-STATE_LOCK = threading.Lock()
-FRAME_LOCK = threading.Lock()
-
-CURRENT_PREDICTION_DATA = {
-    'incident_type': 'Initializing...',
-    'location_gps': 'N/A',
-    'timestamp': 'N/A',
-    'objects_detected': [],
-    'narrative_resources': 'Please wait for initialization...',
-    'events': 'N/A',
-    'final_report': 'N/A',
-    'resources_needed': [],
-    'active_incidents': []
-}
-
-CURRENT_FRAME = None
+from report_service import REPORT_SERVICE
+from main import IncidentTracker
+from tracker import ObjectTracker
+from capture import FrameSource
+from streaming import FrameBroadcaster
+from fire import FireDetector
+from motion import MotionGate
+from profiles import CameraProfile
+from metrics import REGISTRY, PIPELINE_TIMER
+from config import (
+    VIDEO_SOURCES, DEFAULT_CAMERA_ID, DETECTOR_WORKERS, MOBILENET_BATCH_SIZE, MOBILENET_BATCH_WAIT,
+    DETECT_EVERY_N_FRAMES, TARGET_FPS, CAPTURE_POLL_INTERVAL, MOTION_GATE_ENABLED, DETECT_INPUT_SIZE,
+    DETECT_NMS_IOU, YOLO_MODE, YOLO_CONF, CASCADE_MIN_CONF, CASCADE_MARGIN
+)
 
 INCIDENT_TO_RESOURCES = {
     "fire": ["Fire Truck"],
@@ -29,178 +28,585 @@ INCIDENT_TO_RESOURCES = {
     "crash": ["Police"]
 }
 
+MOBILENET_CLASSES = [
+    "background", "aeroplane", "bicycle", "bird", "boat", "bottle",
+    "bus", "car", "cat", "chair", "cow", "diningtable", "dog", "horse",
+    "motorbike", "person", "pottedplant", "sheep", "sofa", "train",
+    "tvmonitor", "truck"
+]
+
+# Both models' labels are mapped onto the names main.VEHICLE_CLASSES and
+# OBSTACLE_CLASSES use, so boxes from either model can be compared and fused
+CLASS_MAP = {
+    "motorbike": "motorcycle",  # MobileNet (VOC)
+    "airplane": "aeroplane",  # YOLO (COCO) from here on
+    "couch": "sofa",
+    "dining table": "diningtable",
+    "potted plant": "pottedplant",
+    "tv": "tvmonitor",
+}
+
+# Incidents built from object boxes; while one is pending or active the
+# cascade keeps YOLO running on the camera
+CASCADE_INCIDENT_TYPES = {"Crash", "Jam", "Person Hit"}
+
+def _initial_prediction_data():
+    return {
+        'incident_type': 'Initializing...',
+        'location_gps': 'N/A',
+        'timestamp': 'N/A',
+        'objects_detected': [],
+        'narrative_resources': 'Please wait for initialization...',
+        'events': 'N/A',
+        'final_report': 'N/A',
+        'resources_needed': [],
+        'active_incidents': []
+    }
+
 def get_dynamic_metadata():
     gps = "PES University RR Campus, Banashankari, Bengaluru 560085"
     timestamp = time.strftime("%H:%M:%S, %d %b %Y", time.localtime())
     return gps, timestamp
 
-def start_detector_thread(video_source=VIDEO_SOURCE, model_dir="mobilenet", conf_threshold=0.5, inference_delay=0.08, use_yolo=False):
-    thread = threading.Thread(
-        target=_detector_worker,
-        args=(video_source, model_dir, conf_threshold, inference_delay, use_yolo),
-        daemon=True
-    )
-    thread.start()
-    return thread
+# --- Per-camera state ---
+class CameraState:
+    """
+    Everything the detector and the web layer share for a single video source.
+    `prediction_data` is guarded by `state_lock`.
+    Every change to `prediction_data` bumps `state_version` so that state
+    stream listeners only wake up when there is something new. The copy handed
+    to listeners is made once per version and shared between them, so it
+    must be treated as read-only.
+    """
+    def __init__(self, camera_id, video_source):
+        self.camera_id = camera_id
+        self.video_source = video_source
+        self.state_lock = threading.Lock()
+        self.state_changed = threading.Condition(self.state_lock)
+        self.state_version = 0
+        self.prediction_data = _initial_prediction_data()
+        self._published = (None, None)
+        self.source = FrameSource(video_source, name=camera_id)
+        self.broadcaster = FrameBroadcaster()
+        self.last_seq = None
+        self.profile = CameraProfile.for_camera(camera_id)
+        self.incident_tracker = IncidentTracker()
+        self.object_tracker = ObjectTracker()
+        self.fire_detector = FireDetector()
+        self.motion_gate = MotionGate(camera_id) if MOTION_GATE_ENABLED else None
+        self.last_detections = []
+        self.last_fire_boxes = []
+        self.last_keywords = None
+        self.frame_index = 0
 
-def _detector_worker(video_source, model_dir, conf_threshold, inference_delay, use_yolo):
-    global CURRENT_FRAME, CURRENT_PREDICTION_DATA
-    from main import classify_incident, VEHICLE_CLASSES, OBSTACLE_CLASSES
+    def snapshot(self):
+        with self.state_lock:
+            return self.prediction_data.copy()
 
-    # --- Load MobileNet SSD ---
-    try:
+    def mark_changed(self):
+        """Bump the state version. Call with `state_lock` held after mutating `prediction_data`."""
+        self.state_version += 1
+        self.state_changed.notify_all()
+
+    def publish(self, fields):
+        """Merge `fields` into `prediction_data` and notify listeners, unless nothing changed."""
+        with self.state_lock:
+            if all(key in self.prediction_data and self.prediction_data[key] == value
+                   for key, value in fields.items()):
+                return
+            self.prediction_data.update(fields)
+            self.mark_changed()
+
+    def wait_for_change(self, last_version, timeout=None):
+        """
+        Block until `state_version` differs from `last_version`; returns
+        (version, read-only copy of prediction_data), or (last_version, None)
+        on timeout. All listeners of one version share the same copy.
+        """
+        with self.state_lock:
+            if not self.state_changed.wait_for(lambda: self.state_version != last_version, timeout):
+                return last_version, None
+            version, data = self._published
+            if version != self.state_version:
+                version, data = self._published = self.state_version, copy.deepcopy(self.prediction_data)
+            return version, data
+
+# --- Camera registry ---
+CAMERAS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+def register_camera(camera_id, video_source):
+    with _REGISTRY_LOCK:
+        if camera_id not in CAMERAS:
+            CAMERAS[camera_id] = CameraState(camera_id, video_source)
+        return CAMERAS[camera_id]
+
+def get_camera(camera_id=None):
+    """Return the CameraState for `camera_id` (default camera if None), or None if unknown."""
+    return CAMERAS.get(camera_id or DEFAULT_CAMERA_ID)
+
+def camera_ids():
+    with _REGISTRY_LOCK:
+        return list(CAMERAS.keys())
+
+# --- Metrics ---
+MODEL_SECONDS = REGISTRY.histogram("resq_model_seconds", "Model inference time by model and step (blob/forward).")
+BATCH_SIZE = REGISTRY.histogram("resq_mobilenet_batch_size", "Frames per batched MobileNet forward pass.",
+                                buckets=(1, 2, 4, 8, 16, 32))
+YOLO_PASSES = REGISTRY.counter("resq_yolo_passes_total",
+                               "Detection passes by whether YOLO ran (always/uncertain/suspect/skipped).")
+FRAME_SECONDS = REGISTRY.histogram("resq_frame_seconds", "End-to-end analysis time per frame.")
+
+def _per_camera(attribute):
+    # Sources that were never started (web workers in process mode) report nothing
+    return lambda: [({"camera": cid}, getattr(cam.source, attribute)) for cid, cam in list(CAMERAS.items())
+                    if cam.source.started]
+
+REGISTRY.collector("resq_capture_frames_total", "Frames read from each video source.",
+                   _per_camera("frames_captured"), "counter")
+REGISTRY.collector("resq_capture_frames_dropped_total", "Captured frames replaced before analysis.",
+                   _per_camera("frames_dropped"), "counter")
+REGISTRY.collector("resq_capture_reconnects_total", "Video source reconnects.", _per_camera("reconnects"), "counter")
+REGISTRY.collector("resq_capture_connected", "1 while the video source is open.", _per_camera("connected"))
+
+# --- Batched MobileNet inference ---
+class MobileNetBatcher:
+    """
+    Collects frames submitted by the detector workers into a single
+    blobFromImages/forward call (up to `max_batch` frames, waiting at most
+    `max_wait` seconds after the first one) and scatters the detections back.
+    Frames with different input sizes in one batch get one pass per size.
+    `max_in_flight`, if given, returns how many frames can be submitted at
+    once (cameras analysed concurrently x their tiles); the batcher stops
+    waiting once that many are collected, so a single camera never waits.
+    """
+    def __init__(self, net, net_lock, max_batch=MOBILENET_BATCH_SIZE, max_wait=MOBILENET_BATCH_WAIT,
+                 max_in_flight=None):
+        self.net = net
+        self.net_lock = net_lock
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max_wait
+        self.max_in_flight = max_in_flight
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="mobilenet-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame, size=DETECT_INPUT_SIZE):
+        """Queue `frame` for inference; returns a Future resolving to its (1, 1, N, 7) detections."""
+        future = Future()
+        self._queue.put((frame, size, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        limit = self.max_batch
+        if self.max_in_flight is not None:
+            limit = max(1, min(limit, self.max_in_flight()))
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            by_size = {}
+            for frame, size, future in self._collect():
+                by_size.setdefault(size, []).append((frame, future))
+            for size, batch in by_size.items():
+                self._forward(batch, size)
+
+    def _forward(self, batch, size):
+        frames = [frame for frame, _ in batch]
+        BATCH_SIZE.observe(len(frames))
+        try:
+            with MODEL_SECONDS.time(model="mobilenet", step="blob"):
+                blob = cv2.dnn.blobFromImages(frames, 0.007843, (size, size), 127.5)
+            with self.net_lock, MODEL_SECONDS.time(model="mobilenet", step="forward"):
+                self.net.setInput(blob)
+                detections = self.net.forward()
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        # Column 0 of each SSD detection row is the index of its image in the batch
+        image_ids = detections[0, 0, :, 0].astype(int)
+        for i, (_, future) in enumerate(batch):
+            future.set_result(detections[:, :, image_ids == i, :])
+
+# --- Shared models ---
+class DetectorModels:
+    """
+    One loaded MobileNet (and optional YOLO) shared by every camera.
+    cv2.dnn.Net is not safe for concurrent setInput/forward, so calls are
+    serialised with a lock; the forward pass itself is parallelised by OpenCV.
+    With batch_size > 1, frames from concurrent workers are batched together.
+    `yolo_mode` is "off", "always" or "cascade" (see YOLO_MODE); it falls
+    back to "off" if YOLO cannot be loaded.
+    """
+    def __init__(self, model_dir="mobilenet", yolo_mode="off", batch_size=MOBILENET_BATCH_SIZE,
+                 batch_wait=MOBILENET_BATCH_WAIT, max_in_flight=None):
         prototxt = f"{model_dir}/MobileNetSSD_deploy.prototxt"
         caffemodel = f"{model_dir}/MobileNetSSD_deploy.caffemodel"
-        net_mobilenet = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
-        net_mobilenet.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.net_mobilenet = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+        self.net_mobilenet.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.mobilenet_lock = threading.Lock()
+        self.batcher = None
+        if batch_size > 1:
+            self.batcher = MobileNetBatcher(self.net_mobilenet, self.mobilenet_lock, batch_size, batch_wait,
+                                            max_in_flight)
+            REGISTRY.collector("resq_mobilenet_queue_depth", "Frames waiting for a batched MobileNet pass.",
+                               self.batcher._queue.qsize)
+
+        self.net_yolo = None
+        self.yolo_lock = threading.Lock()
+        if yolo_mode != "off":
+            try:
+                from ultralytics import YOLO
+                self.net_yolo = YOLO("yolov8n.pt")
+            except Exception as e:
+                print("YOLOv8 not available:", e)
+        self.yolo_mode = yolo_mode if self.net_yolo is not None else "off"
+
+    def detect_mobilenet(self, frame, size=DETECT_INPUT_SIZE):
+        return self.detect_mobilenet_many([frame], size)[0]
+
+    def detect_mobilenet_many(self, frames, size=DETECT_INPUT_SIZE):
+        """MobileNet output for each of `frames` (tiles of one frame), in one forward pass where possible."""
+        if self.batcher is not None:
+            futures = [self.batcher.submit(frame, size) for frame in frames]
+            return [future.result() for future in futures]
+        with MODEL_SECONDS.time(model="mobilenet", step="blob"):
+            blob = cv2.dnn.blobFromImages(frames, 0.007843, (size, size), 127.5)
+        with self.mobilenet_lock, MODEL_SECONDS.time(model="mobilenet", step="forward"):
+            self.net_mobilenet.setInput(blob)
+            detections = self.net_mobilenet.forward()
+        image_ids = detections[0, 0, :, 0].astype(int)
+        return [detections[:, :, image_ids == i, :] for i in range(len(frames))]
+
+    def detect_yolo(self, frame):
+        with self.yolo_lock, MODEL_SECONDS.time(model="yolo", step="forward"):
+            return self.net_yolo(frame, conf=YOLO_CONF, verbose=False)[0]
+
+# --- Scheduler ---
+class _CameraScheduler:
+    """Min-heap of (due_time, camera_id) shared by the worker pool."""
+    def __init__(self):
+        self._heap = []
+        self._cond = threading.Condition()
+
+    def put(self, camera_id, due=None):
+        with self._cond:
+            heapq.heappush(self._heap, (due if due is not None else time.monotonic(), camera_id))
+            self._cond.notify()
+
+    def get(self):
+        with self._cond:
+            while True:
+                if self._heap:
+                    due, camera_id = self._heap[0]
+                    wait = due - time.monotonic()
+                    if wait <= 0:
+                        heapq.heappop(self._heap)
+                        return camera_id
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+def _frames_in_flight(num_workers):
+    """Most frames the workers can submit at once: the `num_workers` cameras with the most tiles."""
+    tiles = sorted((cam.profile.tiles[0] * cam.profile.tiles[1] for cam in list(CAMERAS.values())), reverse=True)
+    return sum(tiles[:num_workers]) or 1
+
+def start_detector_engine(video_sources=None, model_dir="mobilenet", conf_threshold=0.5,
+                          target_fps=TARGET_FPS, yolo_mode=YOLO_MODE, num_workers=DETECTOR_WORKERS):
+    """
+    Register every source in `video_sources` ({camera_id: source}), start a
+    capture thread per source and schedule analysis across a bounded pool of
+    `num_workers` threads sharing one set of models, at up to `target_fps`
+    frames per second per camera. Returns the list of worker threads.
+    """
+    if video_sources is None:
+        video_sources = VIDEO_SOURCES
+    for camera_id, source in video_sources.items():
+        register_camera(camera_id, source).source.start()
+
+    try:
+        models = DetectorModels(model_dir, yolo_mode,
+                                max_in_flight=lambda: _frames_in_flight(max(1, num_workers)))
     except Exception as e:
         print("Error loading MobileNet model:", e)
-        return
+        return []
 
-    # --- Load YOLOv8 (optional) ---
-    net_yolo = None
-    if use_yolo:
+    scheduler = _CameraScheduler()
+    for camera_id in video_sources:
+        scheduler.put(camera_id)
+
+    workers = []
+    for i in range(max(1, min(num_workers, len(video_sources)))):
+        thread = threading.Thread(
+            target=_detector_worker,
+            args=(scheduler, models, conf_threshold, target_fps),
+            name=f"detector-{i}",
+            daemon=True
+        )
+        thread.start()
+        workers.append(thread)
+    return workers
+
+def _detector_worker(scheduler, models, conf_threshold, target_fps):
+    while True:
+        camera_id = scheduler.get()
+        camera = CAMERAS[camera_id]
+        started = time.monotonic()
+        next_due = started + 1.0 / target_fps
         try:
-            from ultralytics import YOLO
-            net_yolo = YOLO("yolov8n.pt")
+            if not _process_camera_once(camera, models, conf_threshold):
+                next_due = started + CAPTURE_POLL_INTERVAL
         except Exception as e:
-            print("YOLOv8 not available:", e)
-            use_yolo = False
+            print(f"Detector error on camera {camera_id}:", e)
+        finally:
+            # Adaptive pacing: aim for target_fps from the start of this frame,
+            # run again straight away if analysis took longer than a frame interval
+            scheduler.put(camera_id, next_due)
 
-    cap = cv2.VideoCapture(video_source)
-    if not cap.isOpened():
-        print(f"Video source {video_source} not available. Exiting detector.")
-        return
+def _process_camera_once(camera, models, conf_threshold):
+    """Analyse the freshest frame for `camera`. Returns False if no new frame was available."""
+    seq, frame = camera.source.latest()
+    if frame is None or seq == camera.last_seq:
+        return False
+    camera.last_seq = seq
+    with FRAME_SECONDS.time(camera=camera.camera_id):
+        _analyze_frame(camera, frame, models, conf_threshold)
+    return True
 
-    MOBILENET_CLASSES = [
-        "background", "aeroplane", "bicycle", "bird", "boat", "bottle",
-        "bus", "car", "cat", "chair", "cow", "diningtable", "dog", "horse",
-        "motorbike", "person", "pottedplant", "sheep", "sofa", "train",
-        "tvmonitor", "truck"
-    ]
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            time.sleep(0.5)
+def _suppress_duplicates(detections, iou_threshold=DETECT_NMS_IOU):
+    """Greedy per-class NMS: keep the most confident of boxes overlapping above `iou_threshold`."""
+    from main import iou_matrix
+    if len(detections) < 2:
+        return detections
+    detections = sorted(detections, key=lambda d: d['conf'], reverse=True)
+    iou = iou_matrix([d['box'] for d in detections], [d['box'] for d in detections])
+    classes = np.array([d['class'] for d in detections])
+    suppressed = np.zeros(len(detections), dtype=bool)
+    kept = []
+    for i, det in enumerate(detections):
+        if suppressed[i]:
             continue
+        kept.append(det)
+        suppressed |= (iou[i] > iou_threshold) & (classes == classes[i])
+    return kept
+
+def _cascade_reason(models, uncertain, suspect):
+    """Why YOLO should run on this detection pass, or None."""
+    if models.yolo_mode == "always":
+        return "always"
+    if models.yolo_mode == "cascade":
+        if suspect:
+            return "suspect"
+        if uncertain:
+            return "uncertain"
+    return None
+
+def _yolo_rect(frame, profile, uncertain, whole):
+    """Pixel rectangle for YOLO: the detector's crop, or just around the uncertain boxes."""
+    h, w = frame.shape[:2]
+    x0, y0, x1, y1 = profile.crop_rect(frame) if profile is not None else (0, 0, w, h)
+    if not whole:
+        boxes = np.asarray(uncertain, dtype=float)
+        ux0, uy0 = (boxes[:, :2].min(axis=0) - CASCADE_MARGIN) * [w, h]
+        ux1, uy1 = (boxes[:, 2:].max(axis=0) + CASCADE_MARGIN) * [w, h]
+        x0, y0 = max(x0, int(ux0)), max(y0, int(uy0))
+        x1, y1 = min(x1, int(np.ceil(ux1))), min(y1, int(np.ceil(uy1)))
+    return x0, y0, x1, y1
+
+def _detect_objects(frame, models, conf_threshold, profile=None, suspect=False):
+    """
+    Run MobileNet on `frame` as seen through the camera's `profile` (ROI crop
+    and mask, tiles, input size), and YOLO as `models.yolo_mode` asks: on
+    every pass, or in cascade only when MobileNet is unsure of a box or
+    `suspect` (an object-based incident is building up) is set. Boxes from
+    both are fused by per-class NMS. Returns detections inside the ROI with
+    boxes normalised to the whole frame and classes mapped through CLASS_MAP.
+    """
+    from main import VEHICLE_CLASSES, OBSTACLE_CLASSES
+    h, w = frame.shape[:2]
+    detections = []
+    uncertain = []
+    # Only boxes that could feed an incident are worth a YOLO pass when unsure
+    cascade_classes = set(VEHICLE_CLASSES) | set(OBSTACLE_CLASSES) | {'person'}
 
-        h, w = frame.shape[:2]
-        detected_objects = []
-        vehicle_boxes = []
-        obstacle_boxes = []
-
-        # --- MobileNet Detection ---
-        blob = cv2.dnn.blobFromImage(frame, 0.007843, (300, 300), 127.5)
-        net_mobilenet.setInput(blob)
-        detections = net_mobilenet.forward()
-        for i in range(detections.shape[2]):
-            conf = float(detections[0, 0, i, 2])
-            idx = int(detections[0, 0, i, 1])
+    # --- MobileNet Detection ---
+    if profile is None:
+        regions, size = [(frame, (0, 0))], DETECT_INPUT_SIZE
+    else:
+        regions, size = profile.regions(frame), profile.input_size
+    outputs = models.detect_mobilenet_many([image for image, _ in regions], size)
+    for (image, (ox, oy)), mobilenet_out in zip(regions, outputs):
+        rh, rw = image.shape[:2]
+        for i in range(mobilenet_out.shape[2]):
+            conf = float(mobilenet_out[0, 0, i, 2])
+            idx = int(mobilenet_out[0, 0, i, 1])
             if idx < 0 or idx >= len(MOBILENET_CLASSES):
                 continue
-            class_name = MOBILENET_CLASSES[idx]
+            class_name = CLASS_MAP.get(MOBILENET_CLASSES[idx], MOBILENET_CLASSES[idx])
+            if conf < conf_threshold and (conf < CASCADE_MIN_CONF or class_name not in cascade_classes):
+                continue
+            x1, y1, x2, y2 = (mobilenet_out[0, 0, i, 3:7] * np.array([rw, rh, rw, rh])).astype(int)
+            box = [(x1 + ox) / w, (y1 + oy) / h, (x2 + ox) / w, (y2 + oy) / h]
             if conf < conf_threshold:
+                uncertain.append(box)
                 continue
-            x1, y1, x2, y2 = (detections[0, 0, i, 3:7] * np.array([w, h, w, h])).astype(int)
-            bbox_norm = [x1 / w, y1 / h, x2 / w, y2 / h]
-            detected_objects.append(class_name)
-            if class_name in VEHICLE_CLASSES or class_name == 'person':
-                vehicle_boxes.append({'box': bbox_norm, 'class': class_name})
-            if class_name in OBSTACLE_CLASSES:
-                obstacle_boxes.append(bbox_norm)
-            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-            cv2.putText(frame, f"{class_name} {int(conf * 100)}%", (max(0, x1), max(15, y1 - 5)),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1)
-
-        # --- YOLOv8 Detection ---
-        if use_yolo and net_yolo is not None:
-            try:
-                results = net_yolo(frame, conf=0.4)[0]
+            detections.append({'box': box, 'class': class_name, 'conf': conf, 'source': 'mobilenet'})
+    fuse = len(regions) > 1
+
+    # --- YOLOv8 Detection ---
+    if profile is not None:
+        uncertain = profile.filter_detections([{'box': box} for box in uncertain])
+        uncertain = [d['box'] for d in uncertain]
+    reason = _cascade_reason(models, uncertain, suspect)
+    if models.yolo_mode != "off":
+        YOLO_PASSES.inc(reason=reason or "skipped")
+    if reason is not None:
+        x0, y0, x1, y1 = _yolo_rect(frame, profile, uncertain, whole=reason != "uncertain")
+        try:
+            if x1 > x0 and y1 > y0:
+                results = models.detect_yolo(frame[y0:y1, x0:x1])
                 for r in results.boxes.data.cpu().numpy():
-                    x1, y1, x2, y2, conf, cls = r
-                    class_name = net_yolo.model.names[int(cls)]
-                    detected_objects.append(class_name)
-                    if class_name in VEHICLE_CLASSES or class_name == 'person':
-                        vehicle_boxes.append({'box': [x1 / w, y1 / h, x2 / w, y2 / h], 'class': class_name})
-                    if class_name in OBSTACLE_CLASSES:
-                        obstacle_boxes.append([x1 / w, y1 / h, x2 / w, y2 / h])
-                    cv2.rectangle(frame, (int(x1), int(y1)), (int(x2), int(y2)), (255, 255, 0), 2)
-                    cv2.putText(frame, f"{class_name} {int(conf * 100)}%", (int(x1), int(y1) - 5),
-                                cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1)
-            except Exception as e:
-                print("YOLO detection error:", e)
+                    bx1, by1, bx2, by2, conf, cls = r
+                    class_name = models.net_yolo.model.names[int(cls)]
+                    detections.append({'box': [(bx1 + x0) / w, (by1 + y0) / h, (bx2 + x0) / w, (by2 + y0) / h],
+                                       'class': CLASS_MAP.get(class_name, class_name),
+                                       'conf': float(conf), 'source': 'yolo'})
+                fuse = True
+        except Exception as e:
+            print("YOLO detection error:", e)
+
+    if fuse:
+        detections = _suppress_duplicates(detections)
+    return profile.filter_detections(detections) if profile is not None else detections
+
+def _split_detections(detections):
+    from main import VEHICLE_CLASSES, OBSTACLE_CLASSES
+    detected_objects = []
+    vehicle_boxes = []
+    obstacle_boxes = []
+    for det in detections:
+        class_name = det['class']
+        detected_objects.append(class_name)
+        if class_name in VEHICLE_CLASSES or class_name == 'person':
+            vehicle = {'box': det['box'], 'class': class_name}
+            if 'track_id' in det:
+                vehicle['track_id'] = det['track_id']
+            vehicle_boxes.append(vehicle)
+        if class_name in OBSTACLE_CLASSES:
+            obstacle_boxes.append(det['box'])
+    return detected_objects, vehicle_boxes, obstacle_boxes
+
+def _draw_detections(frame, detections):
+    h, w = frame.shape[:2]
+    for det in detections:
+        x1, y1, x2, y2 = (int(det['box'][0] * w), int(det['box'][1] * h),
+                          int(det['box'][2] * w), int(det['box'][3] * h))
+        color = (255, 255, 0) if det.get('source') == 'yolo' else (0, 255, 0)
+        label = f"{det['class']} {int(det.get('conf', 0) * 100)}%"
+        if 'track_id' in det:
+            label = f"#{det['track_id']} {label}"
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(frame, label, (max(0, x1), max(15, y1 - 5)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.45, (255, 255, 255), 1)
+
+def _analyze_frame(camera, frame, models, conf_threshold, detect_every=DETECT_EVERY_N_FRAMES, timer=PIPELINE_TIMER):
+    from main import classify_incident
+
+    # --- Unchanged scene: reuse the previous detections ---
+    changed = True
+    if camera.motion_gate is not None:
+        with timer.stage("motion"):
+            changed = camera.motion_gate.should_analyze(frame)
+
+    if changed:
+        # --- Object detection on keyframes, tracking in between ---
+        if camera.frame_index % max(1, detect_every) == 0:
+            with timer.stage("detect"):
+                suspect = bool(camera.incident_tracker.recent_types() & CASCADE_INCIDENT_TYPES)
+                raw_detections = _detect_objects(frame, models, conf_threshold, camera.profile, suspect)
+            with timer.stage("track"):
+                detections = camera.object_tracker.update(raw_detections)
+        else:
+            with timer.stage("track"):
+                detections = camera.object_tracker.predict()
+        camera.frame_index += 1
 
         # --- Fire detection ---
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        lower_fire = np.array([10, 150, 150])
-        upper_fire = np.array([35, 255, 255])
-        mask = cv2.inRange(hsv, lower_fire, upper_fire)
-        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        fire_boxes = []
-        for c in contours:
-            if cv2.contourArea(c) > 400:
-                x, y, w_box, h_box = cv2.boundingRect(c)
-                fire_boxes.append([x, y, x + w_box, y + h_box])
-                cv2.rectangle(frame, (x, y), (x + w_box, y + h_box), (0, 0, 255), 2)
-
-        # --- Multi-incident classification ---
-        if 'active_incidents' not in CURRENT_PREDICTION_DATA:
-            CURRENT_PREDICTION_DATA['active_incidents'] = []
-
-        keywords = classify_incident(
-            detected_objects, vehicle_boxes, obstacle_boxes, fire_boxes,
-            active_incidents=CURRENT_PREDICTION_DATA.get('active_incidents', [])
-        )
+        with timer.stage("fire"):
+            fire_boxes = camera.profile.filter_pixel_boxes(camera.fire_detector.detect(frame), frame.shape)
+        camera.last_detections, camera.last_fire_boxes = detections, fire_boxes
+    else:
+        detections, fire_boxes = camera.last_detections, camera.last_fire_boxes
+    detected_objects, vehicle_boxes, obstacle_boxes = _split_detections(detections)
 
-        gps, timestamp = get_dynamic_metadata()
+    with timer.stage("draw"):
+        camera.profile.draw(frame)
+        _draw_detections(frame, detections)
+        for x1, y1, x2, y2 in fire_boxes:
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 0, 255), 2)
 
-        # --- Generate SEPARATE reports for each detected incident ---
-        reports = []
-        for inc in keywords.get('active_incidents', []):
-            try:
-                single_report = generate_report_from_incident({
-                    "incident_type": inc['type'],
-                    "objects_detected": detected_objects,
-                    "multi_incident_string": f"{inc['type']} (P{inc['priority']})"
-                })
-                reports.append(single_report)
-            except Exception as e:
-                print("Report generation error for", inc['type'], ":", e)
-
-        report_text = "\n\n".join(reports) if reports else "Report generation failed."
-
-        # --- Determine required resources ---
-        resources_needed = set()
-        for inc in keywords['active_incidents']:
-            resources_needed.update(INCIDENT_TO_RESOURCES.get(inc['type'].lower(), []))
-
-        status_text = keywords.get('incident_type', 'N/A')
-        color = (0, 0, 255) if status_text.lower() != 'normal flow' else (0, 255, 0)
-        cv2.putText(frame, f"EVENT: {status_text}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
-
-        # --- Update shared prediction data ---
-        with STATE_LOCK:
-            CURRENT_PREDICTION_DATA.update({
-                'incident_type': keywords.get('incident_type', 'N/A'),
-                'location_gps': gps,
-                'timestamp': timestamp,
-                'objects_detected': detected_objects,
-                'narrative_resources': report_text,
-                'events': keywords.get('multi_incident_string', ''),
-                'final_report': report_text,
-                'resources_needed': list(resources_needed),
-                'active_incidents': keywords.get('active_incidents', [])
-            })
-
-        # --- Frame scaling for UI ---
-        with FRAME_LOCK:
-            max_w = 800
-            if frame.shape[1] > max_w:
-                scale = max_w / frame.shape[1]
-                frame_small = cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)))
-            else:
-                frame_small = frame
-            CURRENT_FRAME = frame_small.copy()
-
-        time.sleep(inference_delay)
+    # --- Multi-incident classification (debounced per camera) ---
+    # A skipped frame repeats the last analysed one, so it must not count as
+    # another hit in the incident window; its classification is reused
+    if changed or camera.last_keywords is None:
+        with timer.stage("classify"):
+            keywords = classify_incident(
+                detected_objects, vehicle_boxes, obstacle_boxes, fire_boxes,
+                tracker=camera.incident_tracker
+            )
+        camera.last_keywords = keywords
+    else:
+        keywords = camera.last_keywords
+
+    gps, timestamp = get_dynamic_metadata()
+
+    # --- Reports are generated in the background; publish the last completed one ---
+    with timer.stage("report"):
+        REPORT_SERVICE.request(camera.camera_id, keywords.get('active_incidents', []), detected_objects)
+        report_text = REPORT_SERVICE.latest(camera.camera_id) or "Generating report..."
+
+    # --- Determine required resources ---
+    resources_needed = set()
+    for inc in keywords['active_incidents']:
+        resources_needed.update(INCIDENT_TO_RESOURCES.get(inc['type'].lower(), []))
+
+    status_text = keywords.get('incident_type', 'N/A')
+    color = (0, 0, 255) if status_text.lower() != 'normal flow' else (0, 255, 0)
+    cv2.putText(frame, f"EVENT: {status_text}", (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+
+    # --- Update shared prediction data ---
+    camera.publish({
+        'camera_id': camera.camera_id,
+        'incident_type': keywords.get('incident_type', 'N/A'),
+        'location_gps': gps,
+        'timestamp': timestamp,
+        'objects_detected': detected_objects,
+        'narrative_resources': report_text,
+        'events': keywords.get('multi_incident_string', ''),
+        'final_report': report_text,
+        'resources_needed': sorted(resources_needed),
+        'active_incidents': keywords.get('active_incidents', [])
+    })
+
+    # --- Frame scaling for UI ---
+    with timer.stage("resize"):
+        max_w = 800
+        if frame.shape[1] > max_w:
+            scale = max_w / frame.shape[1]
+            frame_small = cv2.resize(frame, (int(frame.shape[1] * scale), int(frame.shape[0] * scale)))
+        else:
+            frame_small = frame
+    camera.broadcaster.publish(frame_small)
@@ -0,0 +1,75 @@
+# detector_service.py
+# Standalone detector process: runs capture + inference and publishes every
+# camera's annotated frames and state to shared memory for the web workers
+# (set DETECTOR_MODE = "process" in config.py, then run `python detector_service.py`).
+# It is also the one process that owns dispatch, and serves the dispatch
+# control routes and the pipeline /metrics on DISPATCH_CONTROL_HOST:PORT.
+import signal
+import threading
+from flask import Flask
+from werkzeug.serving import make_server
+import t5_generator
+import dispatch_service
+from detector import start_detector_engine, CAMERAS
+from shared_frames import FrameRing, StateChannel, frames_name, state_name
+from config import VIDEO_SOURCES, T5_WARMUP, DISPATCH_CONTROL_HOST, DISPATCH_CONTROL_PORT
+
+def _publish_frames(camera, ring):
+    version = 0
+    while True:
+        version, frame = camera.broadcaster.wait_frame(version, timeout=1.0)
+        if frame is not None:
+            ring.write(frame)
+
+def _publish_state(camera, channel):
+    version = -1
+    while True:
+        version, data = camera.wait_for_change(version, timeout=1.0)
+        if data is None:
+            continue
+        try:
+            channel.write(data)
+        except ValueError as e:
+            print(f"State for {camera.camera_id} not published:", e)
+
+def main():
+    if T5_WARMUP:
+        t5_generator.warm_up_async()
+    if not start_detector_engine(video_sources=VIDEO_SOURCES, model_dir="mobilenet", conf_threshold=0.5):
+        raise SystemExit("Detector failed to start.")
+
+    segments = []
+    for camera_id, camera in CAMERAS.items():
+        ring = FrameRing.create(frames_name(camera_id))
+        channel = StateChannel.create(state_name(camera_id))
+        segments += [ring, channel]
+        for target, resource in ((_publish_frames, ring), (_publish_state, channel)):
+            threading.Thread(target=target, args=(camera, resource),
+                             name=f"{target.__name__[1:]}-{camera_id}", daemon=True).start()
+        print(f"Publishing camera {camera_id} to shared memory.")
+
+    dispatch_service.start(list(CAMERAS.values()))
+    control_app = Flask(__name__)
+    control_app.register_blueprint(dispatch_service.control)
+    server = make_server(DISPATCH_CONTROL_HOST, DISPATCH_CONTROL_PORT, control_app, threaded=True)
+    threading.Thread(target=server.serve_forever, name="dispatch-control", daemon=True).start()
+    print(f"Dispatch control on http://{DISPATCH_CONTROL_HOST}:{DISPATCH_CONTROL_PORT}")
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        while not stop.wait(1.0):
+            pass
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        for segment in segments:
+            try:
+                segment.close()
+            except BufferError:
+                # A publisher still holds a view; the segment is only unlinked
+                segment.shm.unlink()
+
+if __name__ == '__main__':
+    main()
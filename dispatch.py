@@ -0,0 +1,322 @@
+# dispatch.py
+# Concurrent Twilio alert fan-out over one shared, pooled HTTP client.
+import time
+import random
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from twilio.base.exceptions import TwilioRestException
+from metrics import REGISTRY
+from config import (
+    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_FROM_NUMBER, TWILIO_WHATSAPP_FROM, TWILIO_API_BASE_URL,
+    DISPATCH_WORKERS, DISPATCH_MAX_RETRIES, DISPATCH_RETRY_BASE_DELAY, DISPATCH_RATE_PER_SECOND,
+    DISPATCH_HTTP_TIMEOUT, DISPATCH_DEBOUNCE_SECONDS, DISPATCH_FORGET_SECONDS, DISPATCH_DEFAULT_COUNTRY_CODE
+)
+
+TWILIO_DEFAULT_BASE_URL = "https://api.twilio.com"
+
+TWILIO_SECONDS = REGISTRY.histogram("resq_twilio_request_seconds", "Twilio messages.create() round trip.")
+TWILIO_REQUESTS = REGISTRY.counter("resq_twilio_requests_total", "Twilio requests by result (ok/retry/error).")
+ALERTS = REGISTRY.counter("resq_alerts_total", "Alerts by outcome (sent/failed/deduplicated).")
+
+class _PooledHttpClient(TwilioHttpClient):
+    """
+    TwilioHttpClient with a connection pool sized for the dispatch workers and
+    an optional base URL override (e.g. a local fake Twilio endpoint for tests).
+    """
+    def __init__(self, base_url=None, pool_size=DISPATCH_WORKERS, timeout=DISPATCH_HTTP_TIMEOUT):
+        super().__init__(pool_connections=True, timeout=timeout)
+        self.base_url = base_url.rstrip('/') if base_url else None
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_url and url.startswith(TWILIO_DEFAULT_BASE_URL):
+            url = self.base_url + url[len(TWILIO_DEFAULT_BASE_URL):]
+        return super().request(method, url, *args, **kwargs)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_twilio_client():
+    """Shared Twilio client; its HTTP session keeps connections alive across messages."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = Client(
+                    TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN,
+                    http_client=_PooledHttpClient(TWILIO_API_BASE_URL)
+                )
+    return _client
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second with bursts of up to `rate`."""
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self._tokens = self.rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def _is_retryable(error):
+    if isinstance(error, TwilioRestException):
+        return error.status == 429 or error.status >= 500
+    # Connection errors, timeouts, etc.
+    return True
+
+def normalize_phone(number, default_country_code=DISPATCH_DEFAULT_COUNTRY_CODE):
+    """
+    E.164 form of `number` ('+<digits>'), accepting Twilio 'whatsapp:' addresses,
+    spaces, dashes, brackets and a '00' international prefix. Numbers without a
+    country code get `default_country_code`. Returns None if there are no digits.
+    """
+    number = (number or "").strip()
+    if number.lower().startswith("whatsapp:"):
+        number = number[len("whatsapp:"):]
+    has_plus = number.startswith("+")
+    digits = "".join(ch for ch in number if ch.isdigit())
+    if not digits:
+        return None
+    if not has_plus:
+        if digits.startswith("00"):
+            digits = digits[2:]
+        elif not digits.startswith(default_country_code) or len(digits) <= 10:
+            digits = default_country_code + digits.lstrip("0")
+    return "+" + digits
+
+def alert_body(resource, incident_type, location, timestamp):
+    return (
+        f"*RESQ ALERT*\nIncident: {incident_type}\nResource: {resource}\n"
+        f"Location: {location}\nTime: {timestamp}\n\n"
+        "Reply 'Confirm Dispatch' or 'Decline'."
+    )
+
+def sms_body(resource, incident_type, location, timestamp):
+    return f"RESQ ALERT: Incident: {incident_type}, Resource: {resource}, Location: {location}, Time: {timestamp}"
+
+class AlertDispatcher:
+    """
+    Sends alerts to many recipients concurrently on a bounded worker pool.
+
+    Each message is tried over WhatsApp, then SMS, with exponential-backoff
+    retries for throttling/server/network errors and a shared rate limit.
+    Messages carry an idempotency key: a key that already succeeded returns the
+    earlier SID, and concurrent sends with the same key share one attempt.
+    """
+    def __init__(self, client=None, workers=DISPATCH_WORKERS, max_retries=DISPATCH_MAX_RETRIES,
+                 retry_base_delay=DISPATCH_RETRY_BASE_DELAY, rate_per_second=DISPATCH_RATE_PER_SECOND,
+                 max_remembered=10000):
+        self._client = client
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dispatch")
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.rate_limiter = RateLimiter(rate_per_second)
+        # Re-entrant: a future that is already done runs its callback inside submit()
+        self._lock = threading.RLock()
+        self._completed = OrderedDict()  # idempotency key -> sid
+        self._in_flight = {}  # idempotency key -> Future
+        self._max_remembered = max_remembered
+
+    @property
+    def client(self):
+        return self._client or get_twilio_client()
+
+    def _create(self, **kwargs):
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                with TWILIO_SECONDS.time():
+                    msg = self.client.messages.create(**kwargs)
+                TWILIO_REQUESTS.inc(result="ok")
+                return msg
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    TWILIO_REQUESTS.inc(result="error")
+                    raise
+                TWILIO_REQUESTS.inc(result="retry")
+                delay = self.retry_base_delay * (2 ** attempt)
+                time.sleep(delay + random.uniform(0, delay))
+                attempt += 1
+
+    def send_with_fallback(self, to_number, resource, incident_type, location, timestamp):
+        """Blocking WhatsApp-then-SMS send to one recipient. Returns the message SID or None."""
+        try:
+            msg = self._create(
+                from_=TWILIO_WHATSAPP_FROM,
+                to=f'whatsapp:{to_number}',
+                body=alert_body(resource, incident_type, location, timestamp)
+            )
+            print(f"WhatsApp message sent to {to_number}, SID: {getattr(msg, 'sid', None)}")
+            return getattr(msg, 'sid', None)
+        except Exception as e:
+            print(f"WhatsApp failed for {to_number}: {e}")
+        try:
+            msg_sms = self._create(
+                from_=TWILIO_FROM_NUMBER,
+                to=to_number,
+                body=sms_body(resource, incident_type, location, timestamp)
+            )
+            print(f"SMS fallback sent to {to_number}, SID: {getattr(msg_sms, 'sid', None)}")
+            return getattr(msg_sms, 'sid', None)
+        except Exception as sms_e:
+            print(f"SMS fallback also failed for {to_number}: {sms_e}")
+            return None
+
+    def submit(self, message):
+        """
+        Queue one alert. `message` is a dict with 'to', 'resource',
+        'incident_type', 'location', 'timestamp' and optionally
+        'idempotency_key'. Returns a Future resolving to the SID or None.
+        """
+        key = message.get('idempotency_key')
+        with self._lock:
+            if key is not None:
+                if key in self._completed:
+                    ALERTS.inc(outcome="deduplicated")
+                    return _resolved(self._completed[key])
+                if key in self._in_flight:
+                    ALERTS.inc(outcome="deduplicated")
+                    return self._in_flight[key]
+            future = self._executor.submit(
+                self.send_with_fallback,
+                message['to'], message['resource'], message['incident_type'],
+                message['location'], message['timestamp']
+            )
+            if key is not None:
+                self._in_flight[key] = future
+                future.add_done_callback(lambda f, key=key: self._finish(key, f))
+        return future
+
+    def _finish(self, key, future):
+        with self._lock:
+            self._in_flight.pop(key, None)
+            sid = None if future.exception() else future.result()
+            ALERTS.inc(outcome="sent" if sid is not None else "failed")
+            if sid is not None:
+                self._completed[key] = sid
+                while len(self._completed) > self._max_remembered:
+                    self._completed.popitem(last=False)
+
+    def send_all(self, messages):
+        """Send every message concurrently and wait; returns SIDs (or None) in the same order."""
+        futures = [self.submit(message) for message in messages]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                print("Dispatch error:", e)
+                results.append(None)
+        return results
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+def _resolved(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+DISPATCHER = AlertDispatcher()
+REGISTRY.collector("resq_alerts_in_flight", "Alerts currently being sent.", DISPATCHER.in_flight)
+
+# --- Incident-keyed dispatch state machine ---
+INCIDENT_PENDING = "pending"
+INCIDENT_SENDING = "sending"
+INCIDENT_SENT = "sent"
+INCIDENT_CONFIRMED = "confirmed"
+INCIDENT_CANCELLED = "cancelled"
+
+_INCIDENT_TRANSITIONS = {
+    INCIDENT_PENDING: {INCIDENT_SENDING, INCIDENT_CANCELLED},
+    INCIDENT_SENDING: {INCIDENT_SENT, INCIDENT_CONFIRMED, INCIDENT_CANCELLED},
+    INCIDENT_SENT: {INCIDENT_CONFIRMED, INCIDENT_CANCELLED},
+    INCIDENT_CONFIRMED: {INCIDENT_CANCELLED},
+    INCIDENT_CANCELLED: set(),
+}
+
+class IncidentDispatchStates:
+    """
+    Tracks one dispatch lifecycle per incident id:
+    pending -> sending -> sent -> confirmed, with cancelled reachable from any
+    non-terminal state. An incident must stay active for `debounce_seconds`
+    before it is due, becomes due exactly once, and is forgotten after it has
+    not been observed for `forget_seconds`.
+    """
+    def __init__(self, debounce_seconds=DISPATCH_DEBOUNCE_SECONDS, forget_seconds=DISPATCH_FORGET_SECONDS):
+        self.debounce_seconds = debounce_seconds
+        self.forget_seconds = forget_seconds
+        self._lock = threading.Lock()
+        self._incidents = {}  # incident id -> {'state', 'first_seen', 'last_seen'}
+
+    def _entry(self, incident_id, now):
+        entry = self._incidents.get(incident_id)
+        if entry is None:
+            entry = self._incidents[incident_id] = {'state': INCIDENT_PENDING, 'first_seen': now, 'last_seen': now}
+        entry['last_seen'] = now
+        return entry
+
+    def observe(self, incident_ids, now=None):
+        """
+        Record that `incident_ids` are currently active. Returns the ids that
+        just became due for dispatch (they move to 'sending').
+        """
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            for incident_id in incident_ids:
+                entry = self._entry(incident_id, now)
+                if entry['state'] == INCIDENT_PENDING and now - entry['first_seen'] >= self.debounce_seconds:
+                    entry['state'] = INCIDENT_SENDING
+                    due.append(incident_id)
+            for incident_id in [k for k, e in self._incidents.items() if now - e['last_seen'] > self.forget_seconds]:
+                del self._incidents[incident_id]
+        return due
+
+    def claim(self, incident_id, now=None):
+        """Skip the debounce window (manual dispatch). True if the caller should send."""
+        now = time.time() if now is None else now
+        with self._lock:
+            entry = self._entry(incident_id, now)
+            if entry['state'] != INCIDENT_PENDING:
+                return False
+            entry['state'] = INCIDENT_SENDING
+            return True
+
+    def transition(self, incident_id, state):
+        """Move `incident_id` to `state` if allowed; returns whether it moved."""
+        with self._lock:
+            entry = self._incidents.get(incident_id)
+            if entry is None or state not in _INCIDENT_TRANSITIONS[entry['state']]:
+                return False
+            entry['state'] = state
+            return True
+
+    def state(self, incident_id):
+        with self._lock:
+            entry = self._incidents.get(incident_id)
+            return entry['state'] if entry else None
+
+    def snapshot(self):
+        with self._lock:
+            return {incident_id: entry['state'] for incident_id, entry in self._incidents.items()}
@@ -0,0 +1,434 @@
+# dispatch_service.py
+# Dispatch state, alert outbox, responder replies, incident logging and the
+# auto-dispatch monitor.
+# Exactly one process owns these: the Flask app itself in thread mode, or
+# detector_service.py in process mode, which serves the control routes below
+# for the web workers to forward to.
+import time
+import copy
+import threading
+import traceback
+from datetime import datetime
+from flask import Blueprint, Response, request, jsonify, abort
+from twilio.twiml.messaging_response import MessagingResponse
+
+from detector import INCIDENT_TO_RESOURCES
+from config import DEFAULT_CAMERA_ID
+from dispatch import (
+    normalize_phone, IncidentDispatchStates, INCIDENT_PENDING, INCIDENT_SENDING, INCIDENT_SENT, INCIDENT_CONFIRMED,
+    INCIDENT_CANCELLED
+)
+from outbox import AlertOutbox, STATUS_PENDING, STATUS_SENDING, STATUS_SENT, STATUS_FAILED
+from resources import RESOURCE_RECEIVERS
+from db_utils import INCIDENT_LOG, ACTIVATION_LOG
+from rollups import INCIDENT_ROLLUPS
+from metrics import REGISTRY
+
+# Cameras dispatched for (camera_id -> CameraState); bound by start()
+DISPATCH_CAMERAS = {}
+OUTBOX = None
+
+# --- Dispatch State ---
+# camera_id -> that camera's dispatch state. Everything kept per camera is
+# guarded by the camera's state_lock, and its dispatch_status lives in the
+# camera's own prediction_data.
+camera_dispatch_state = {}
+
+def _new_dispatch_state():
+    return {
+        "status": "Not Sent",
+        "timestamp": None,
+        "receivers_map": {},
+        "sids": {},
+    }
+
+def _state(camera):
+    return camera_dispatch_state.setdefault(camera.camera_id, _new_dispatch_state())
+
+# --- Recipient lookup for webhook replies ---
+# camera_id -> normalised (E.164) phone number -> dispatch_status key
+RECIPIENTS_BY_PHONE = {}
+
+# --- Logging ---
+# Statistics are rolled up from every batch the background writers store:
+# incident counts from activations, dispatch counts and latency from the log
+INCIDENT_LOG.on_written.append(INCIDENT_ROLLUPS.apply)
+ACTIVATION_LOG.on_written.append(INCIDENT_ROLLUPS.apply_activations)
+
+def _incident_summary(incident):
+    return {"id": incident['id'], "type": incident['type'], "since": incident.get('since')}
+
+def _activation_logger(camera):
+    """Tracker callback queueing one activation document per batch of incidents `camera` opened."""
+    def log_activations(incidents):
+        ACTIVATION_LOG.log({
+            "camera_id": camera.camera_id,
+            "timestamp": datetime.now(),
+            "incidents": [_incident_summary(inc) for inc in incidents],
+        })
+    return log_activations
+
+def _changed(camera):
+    # Call with camera.state_lock held after changing its dispatch state. The
+    # copy in prediction_data reaches the dashboard in this process and,
+    # through the state channel, in every web worker.
+    camera.prediction_data['_dispatch_state'] = copy.deepcopy(_state(camera))
+    camera.mark_changed()
+
+def _camera(camera_id=None):
+    """The dispatched CameraState for `camera_id` (default camera if None); ValueError if unknown."""
+    camera = DISPATCH_CAMERAS.get(camera_id or DEFAULT_CAMERA_ID)
+    if camera is None:
+        raise ValueError(f"Unknown camera: {camera_id!r}")
+    return camera
+
+def _dispatch_id(camera, incident_id):
+    # Incident ids are only unique per tracker, so dispatch keys them by camera
+    return f"{camera.camera_id}:{incident_id}"
+
+def log_incident(camera):
+    """Queue a snapshot of `camera`'s state for the background MongoDB writer (never blocks on the database)."""
+    states = DISPATCH_STATES.snapshot()
+    with camera.state_lock:
+        data = camera.prediction_data
+        # Deep copies: the live state keeps changing while the document waits in the buffer
+        doc = {
+            "detected_objects": list(data.get('objects_detected', [])),
+            "objects_count": len(data.get('objects_detected', [])),
+            "object_person_count": data.get('objects_detected', []).count('person'),
+            "object_vehicle_count": data.get('objects_detected', []).count('vehicle'),
+            "gps": copy.deepcopy(data.get('location_gps', {'lat': 0, 'lng': 0})),
+            "incident_type": data.get('incident_type', 'Unknown'),
+            "incident_types": sorted({inc['type'] for inc in data.get('active_incidents', [])}),
+            "incidents": [_incident_summary(inc) for inc in data.get('active_incidents', []) if inc.get('id')],
+            "dispatched": [_incident_summary(inc) for inc in data.get('active_incidents', []) if inc.get('id')
+                           and states.get(_dispatch_id(camera, inc['id'])) not in (None, INCIDENT_PENDING)],
+            "camera_id": camera.camera_id,
+            "multi_incident_string": copy.deepcopy(data.get('events', '')),
+            "report_text": data.get('final_report', ''),
+            "timestamp": datetime.now(),
+            "severity_level": data.get('severity_level', 3),
+            "dispatch_status": copy.deepcopy(data.get('dispatch_status', {})),
+            "dispatch_state_snapshot": copy.deepcopy(_state(camera)),
+            "events": copy.deepcopy(data.get('events', [])),
+            "resources_needed": list(data.get('resources_needed', []))
+        }
+    INCIDENT_LOG.log(doc)
+
+# --- Durable alert outbox ---
+OUTBOX_STATUS_LABELS = {
+    STATUS_PENDING: "Queued",
+    STATUS_SENDING: "Queued",
+    STATUS_SENT: "Sent",
+    STATUS_FAILED: "Failed",
+}
+
+def _on_outbox_status(message, status, sid):
+    """Reflect delivery progress of dispatch alerts in dispatch_status."""
+    camera = DISPATCH_CAMERAS.get(message.get('camera_id', DEFAULT_CAMERA_ID))
+    if message.get('kind') != 'dispatch' or camera is None:
+        return
+    with camera.state_lock:
+        entry = camera.prediction_data.get('dispatch_status', {}).get(message['to'])
+        # Never overwrite a responder's answer or a cancellation
+        if entry is None or entry.get('idempotency_key') != message['idempotency_key'] \
+                or entry.get('status') not in OUTBOX_STATUS_LABELS.values():
+            return
+        entry['status'] = OUTBOX_STATUS_LABELS[status]
+        entry['sid'] = sid
+        _state(camera).setdefault('sids', {})[message['to']] = {"resource": message['resource'], "sid": sid}
+        if status == STATUS_SENT:
+            DISPATCH_STATES.transition(message.get('incident_id'), INCIDENT_SENT)
+            _sync_dispatch_state(camera)
+        _changed(camera)
+
+# --- Incident dispatch state ---
+# One lifecycle per incident, keyed by _dispatch_id (camera id + incident id)
+DISPATCH_STATES = IncidentDispatchStates()
+# Incidents a cancel still applies to
+OPEN_INCIDENT_STATES = (INCIDENT_PENDING, INCIDENT_SENDING, INCIDENT_SENT)
+
+def _actionable_incidents(camera, data):
+    """
+    Tracked incidents that need responders (everything except Normal Flow),
+    with their ids replaced by dispatch ids.
+    """
+    return [dict(inc, id=_dispatch_id(camera, inc['id'])) for inc in data.get('active_incidents', [])
+            if inc.get('id') and inc.get('type', '').lower() != 'normal flow']
+
+def _sync_dispatch_state(camera):
+    # Call with camera.state_lock held. Closed (confirmed, cancelled or
+    # forgotten) incidents and the recipients only they used are dropped.
+    dispatch_state = _state(camera)
+    prefix = _dispatch_id(camera, "")
+    states = {i: state for i, state in DISPATCH_STATES.snapshot().items() if i.startswith(prefix)}
+    open_ids = {i for i in dispatch_state.get('incident_ids', []) if states.get(i) in OPEN_INCIDENT_STATES}
+    dispatch_state['incident_ids'] = [i for i in dispatch_state.get('incident_ids', []) if i in open_ids]
+    receivers_map = {}
+    for number, incident_ids in dispatch_state.get('receivers_map', {}).items():
+        still_open = [i for i in incident_ids if i in open_ids]
+        if still_open:
+            receivers_map[number] = still_open
+    dispatch_state['receivers_map'] = receivers_map
+    dispatch_state['incidents'] = states
+
+# --- Core Dispatch (non-blocking: alerts are queued in the outbox) ---
+def perform_dispatch(camera, now_data, incidents):
+    """Queue alerts for `camera`'s `incidents` (already claimed in DISPATCH_STATES)."""
+    messages = []
+    for inc in incidents:
+        for resource in INCIDENT_TO_RESOURCES.get(inc['type'].lower(), []):
+            for number in RESOURCE_RECEIVERS.get(resource, []):
+                messages.append({
+                    "kind": "dispatch",
+                    "camera_id": camera.camera_id,
+                    "incident_id": inc['id'],
+                    "to": number,
+                    "resource": resource,
+                    "incident_type": now_data.get('incident_type', inc['type']),
+                    "location": now_data.get('location_gps', 'Unknown'),
+                    "timestamp": now_data.get('timestamp', datetime.now().isoformat()),
+                    "idempotency_key": f"dispatch:{inc['id']}:{resource}:{number}"
+                })
+    if not messages:
+        return False
+
+    statuses = OUTBOX.enqueue(messages)
+
+    with camera.state_lock:
+        dispatch_state = _state(camera)
+        dispatch_state['status'] = "Sent"
+        dispatch_state['timestamp'] = datetime.now().isoformat()
+        dispatch_state.setdefault('incident_ids', [])
+        dispatch_state['incident_ids'].extend(inc['id'] for inc in incidents)
+        # Recipient -> open incident ids it was alerted for
+        receivers_map = dispatch_state.setdefault('receivers_map', {})
+        for message in messages:
+            incident_ids = receivers_map.setdefault(message['to'], [])
+            if message['incident_id'] not in incident_ids:
+                incident_ids.append(message['incident_id'])
+        RECIPIENTS_BY_PHONE.setdefault(camera.camera_id, {}).update(
+            {normalize_phone(m['to']): m['to'] for m in messages if normalize_phone(m['to'])})
+        dispatch_state.setdefault('sids', {})
+        dispatch_status_map = camera.prediction_data.setdefault('dispatch_status', {})
+        for message in messages:
+            dispatch_status_map[message['to']] = {
+                "status": OUTBOX_STATUS_LABELS[statuses[message['idempotency_key']]],
+                "resources": [message['resource']],
+                "sid": None,
+                "incident_id": message['incident_id'],
+                "idempotency_key": message['idempotency_key'],
+                "dispatched_at": time.time()
+            }
+        _sync_dispatch_state(camera)
+        _changed(camera)
+
+    log_incident(camera)
+    return True
+
+def dispatch_due_incidents():
+    """
+    Auto-dispatch: each actionable incident on any camera is sent once, after
+    the debounce window. Every camera's incidents are observed together.
+    """
+    snapshots = [(camera, camera.snapshot()) for camera in list(DISPATCH_CAMERAS.values())]
+    incidents = {camera.camera_id: _actionable_incidents(camera, data) for camera, data in snapshots}
+    due = set(DISPATCH_STATES.observe([inc['id'] for found in incidents.values() for inc in found]))
+    dispatched = False
+    for camera, data in snapshots:
+        camera_due = [inc for inc in incidents[camera.camera_id] if inc['id'] in due]
+        if camera_due:
+            dispatched = perform_dispatch(camera, data, camera_due) or dispatched
+    return dispatched
+
+def dispatch_now(camera, now_data):
+    """Manual dispatch: skips the debounce window but still never sends an incident twice."""
+    incidents = [inc for inc in _actionable_incidents(camera, now_data) if DISPATCH_STATES.claim(inc['id'])]
+    if not incidents:
+        return False
+    return perform_dispatch(camera, now_data, incidents)
+
+# --- Cancel Dispatch ---
+def perform_cancel_dispatch(camera):
+    """Cancel `camera`'s incidents that are still open and notify only their recipients."""
+    with camera.state_lock:
+        dispatch_state = _state(camera)
+        _sync_dispatch_state(camera)
+        incident_ids = list(dispatch_state.get('incident_ids', []))
+        default_numbers = list(dispatch_state.get('receivers_map', {}).keys())
+        if not incident_ids or not default_numbers:
+            return False
+        for incident_id in incident_ids:
+            DISPATCH_STATES.transition(incident_id, INCIDENT_CANCELLED)
+
+    cancel_time = datetime.now().isoformat()
+    cancel_key = "+".join(sorted(incident_ids)) or "unknown"
+    messages = [{
+        "kind": "cancel",
+        "camera_id": camera.camera_id,
+        "to": number,
+        "resource": "ALL",
+        "incident_type": "Incident Cancelled",
+        "location": "N/A",
+        "timestamp": cancel_time,
+        "idempotency_key": f"cancel:{cancel_key}:{number}"
+    } for number in default_numbers]
+    statuses = OUTBOX.enqueue(messages)
+
+    with camera.state_lock:
+        dispatch_state['status'] = "Cancelled"
+        dispatch_state['cancel_timestamp'] = cancel_time
+        dispatch_state['cancel_statuses'] = {m['to']: statuses[m['idempotency_key']] for m in messages}
+        dispatch_status_map = camera.prediction_data.setdefault('dispatch_status', {})
+        for num in default_numbers:
+            entry = dispatch_status_map.get(num)
+            # Answers to incidents that were already closed are kept
+            if entry is not None and entry.get('incident_id') in incident_ids \
+                    and entry.get('status') in OUTBOX_STATUS_LABELS.values():
+                entry['status'] = "Cancelled"
+        _sync_dispatch_state(camera)
+        _changed(camera)
+
+    log_incident(camera)
+    return True
+
+# --- Responder replies (Twilio WhatsApp webhook) ---
+def _find_recipient(from_number):
+    """
+    (camera, dispatch_status key) of the dispatch a reply from `from_number`
+    answers: the latest one still awaiting an answer, otherwise the latest
+    one at all. (None, None) if the number was never alerted.
+    """
+    best_rank, best = None, (None, None)
+    for camera in list(DISPATCH_CAMERAS.values()):
+        with camera.state_lock:
+            number = RECIPIENTS_BY_PHONE.get(camera.camera_id, {}).get(from_number)
+            entry = camera.prediction_data.get('dispatch_status', {}).get(number) if number else None
+            if entry is None:
+                continue
+            rank = (entry.get('status') == 'Sent', entry.get('dispatched_at') or 0)
+        if best_rank is None or rank > best_rank:
+            best_rank, best = rank, (camera, number)
+    return best
+
+def handle_reply(body, sender):
+    """Apply a responder's reply; returns the TwiML response text."""
+    incoming_msg = body.strip().lower()
+    camera, matched_number = _find_recipient(normalize_phone(sender))
+    response = MessagingResponse()
+    released = []
+    if camera is None:
+        response.message("Your number is not recognized for any current dispatch.")
+        return str(response)
+
+    # Only state transitions happen under the lock; notifications go through the outbox
+    with camera.state_lock:
+        dispatch_status_map = camera.prediction_data.get('dispatch_status', {})
+        entry = dispatch_status_map.get(matched_number)
+
+        if entry is not None:
+            user_status = entry.get('status', 'Sent')
+            resource = entry['resources'][0]
+
+            if 'confirm' in incoming_msg and user_status == 'Sent':
+                entry['status'] = 'Confirmed'
+                entry['confirmed_at'] = time.time()
+                DISPATCH_STATES.transition(entry.get('incident_id'), INCIDENT_CONFIRMED)
+                _sync_dispatch_state(camera)
+                response.message("Thank you. Your dispatch status has been logged.")
+
+                # Other responders for the same resource are released
+                for num, info in dispatch_status_map.items():
+                    if num != matched_number and info['resources'][0] == resource and info['status'] == 'Sent':
+                        info['status'] = 'Cancelled'
+                        released.append((num, info.get('incident_id')))
+
+            elif 'decline' in incoming_msg and user_status == 'Sent':
+                entry['status'] = 'Declined'
+                response.message("You have declined the dispatch.")
+            else:
+                response.message("Your response cannot be processed. Dispatch already handled.")
+        else:
+            response.message("Your number is not recognized for any current dispatch.")
+
+        _changed(camera)
+
+    if released:
+        release_time = datetime.now().isoformat()
+        OUTBOX.enqueue([{
+            "kind": "release",
+            "camera_id": camera.camera_id,
+            "to": num,
+            "resource": resource,
+            "incident_type": "No longer needed",
+            "location": "N/A",
+            "timestamp": release_time,
+            "idempotency_key": f"release:{incident_id}:{resource}:{num}"
+        } for num, incident_id in released])
+
+    log_incident(camera)
+    return str(response)
+
+
+# --- Background monitor (one fan-out per incident) ---
+def _dispatch_monitor_loop():
+    print("Dispatch monitor started.")
+    while True:
+        try:
+            dispatch_due_incidents()  # Only queues alerts
+            time.sleep(1.0)
+        except Exception as e:
+            print("Error in dispatch monitor loop:", e)
+            traceback.print_exc()
+            time.sleep(1.0)
+
+def start(cameras):
+    """
+    Own dispatch for `cameras` in this process: log their incident
+    activations, start the outbox sender and the auto-dispatch monitor.
+    """
+    global OUTBOX
+    for camera in cameras:
+        DISPATCH_CAMERAS[camera.camera_id] = camera
+        camera.incident_tracker.on_opened.append(_activation_logger(camera))
+        with camera.state_lock:
+            _changed(camera)
+    OUTBOX = AlertOutbox(on_status=_on_outbox_status).start()
+    REGISTRY.collector("resq_outbox_messages", "Outbox rows by status.",
+                       lambda: [({"status": status}, n) for status, n in OUTBOX.counts().items()])
+    threading.Thread(target=_dispatch_monitor_loop, name="dispatch-monitor", daemon=True).start()
+
+def run_action(action, camera_id=None):
+    """
+    Run a dashboard dispatch action ("auto", "send" or "cancel") for
+    `camera_id` (default camera if None); True if anything was queued.
+    "auto" dispatches whatever is due on every camera.
+    """
+    camera = _camera(camera_id)
+    if action == "cancel":
+        return perform_cancel_dispatch(camera)
+    if action == "auto":
+        return dispatch_due_incidents()
+    if action == "send":
+        return dispatch_now(camera, camera.snapshot())
+    raise ValueError(f"Unknown dispatch action: {action!r}")
+
+# --- Control routes (served by detector_service.py in process mode) ---
+control = Blueprint('control', __name__)
+
+@control.route('/control/<action>', methods=['POST'])
+def control_action(action):
+    try:
+        return jsonify({"queued": bool(run_action(action, request.args.get('camera')))})
+    except ValueError as e:
+        abort(404, str(e))
+
+@control.route('/twilio_webhook', methods=['POST'])
+def control_webhook():
+    return handle_reply(request.form.get('Body', ''), request.form.get('From', ''))
+
+@control.route('/metrics')
+def control_metrics():
+    if not REGISTRY.enabled:
+        abort(404)
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
@@ -1,3 +1,6 @@
+import time
+import uuid
+from collections import deque
 import numpy as np
 
 VEHICLE_CLASSES = ['car', 'bicycle', 'truck', 'bus', 'motorcycle']
@@ -5,6 +8,13 @@ OBSTACLE_CLASSES = ['pottedplant', 'chair', 'diningtable', 'sofa', 'tvmonitor']
 CLUSTER_MAX_DISTANCE = 0.15
 JAM_CLUSTER_SIZE = 4
 
+# Temporal incident tracking: an incident becomes active once it is seen in
+# INCIDENT_MIN_HITS of the last INCIDENT_WINDOW frames, and expires after
+# INCIDENT_EXPIRY_SECONDS without being seen.
+INCIDENT_WINDOW = 10
+INCIDENT_MIN_HITS = 6
+INCIDENT_EXPIRY_SECONDS = 10.0
+
 def boxes_touch_or_overlap(box1, box2):
     x1a, y1a, x2a, y2a = box1
     x1b, y1b, x2b, y2b = box2
@@ -21,29 +31,63 @@ def boxes_overlap_significantly(box1, box2, threshold=0.02):
         return False
     return (intersection_area / union_area) > threshold
 
+def _as_box_array(boxes):
+    return np.asarray(boxes, dtype=float).reshape(-1, 4)
+
+def touch_matrix(boxes_a, boxes_b):
+    """Vectorised boxes_touch_or_overlap: (len(a), len(b)) boolean matrix."""
+    a = _as_box_array(boxes_a)[:, None, :]
+    b = _as_box_array(boxes_b)[None, :, :]
+    return ~((a[..., 2] < b[..., 0]) | (b[..., 2] < a[..., 0]) |
+             (a[..., 3] < b[..., 1]) | (b[..., 3] < a[..., 1]))
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU as computed by boxes_overlap_significantly; 0 where the union is empty."""
+    a = _as_box_array(boxes_a)[:, None, :]
+    b = _as_box_array(boxes_b)[None, :, :]
+    x_overlap = np.maximum(0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]))
+    y_overlap = np.maximum(0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]))
+    intersection_area = x_overlap * y_overlap
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union_area = area_a + area_b - intersection_area
+    iou = np.zeros(union_area.shape)
+    np.divide(intersection_area, union_area, out=iou, where=union_area > 0)
+    return iou
+
+def _largest_component(adjacency):
+    """Size of the largest connected component of a symmetric boolean adjacency matrix (union-find)."""
+    n = adjacency.shape[0]
+    parent = np.arange(n)
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows, cols = np.nonzero(np.triu(adjacency, k=1))
+    for i, j in zip(rows.tolist(), cols.tolist()):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[root_j] = root_i
+
+    roots = np.array([find(i) for i in range(n)])
+    _, counts = np.unique(roots, return_counts=True)
+    return int(np.max(counts))
+
 def cluster_boxes(vehicle_boxes):
+    """Size of the largest group of boxes chained together by centre distance < CLUSTER_MAX_DISTANCE."""
     if not vehicle_boxes:
         return 0
-    centers = []
-    for v in vehicle_boxes:
-        x_center = (v['box'][0] + v['box'][2]) / 2
-        y_center = (v['box'][1] + v['box'][3]) / 2
-        centers.append([x_center, y_center])
-    centers = np.array(centers)
-    n = len(centers)
-    labels = np.arange(n)
-    for i in range(n):
-        for j in range(i+1, n):
-            dist = np.linalg.norm(centers[i] - centers[j])
-            if dist < CLUSTER_MAX_DISTANCE:
-                labels[labels == labels[j]] = labels[i]
-    unique_labels, counts = np.unique(labels, return_counts=True)
-    return int(np.max(counts)) if counts.size > 0 else 0  # CRITICAL FIX
-
-def classify_incident(detected_objects, vehicle_boxes, obstacle_boxes, fire_boxes, active_incidents=None):
-    if active_incidents is None:
-        active_incidents = []
-
+    boxes = _as_box_array([v['box'] for v in vehicle_boxes])
+    centers = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+    diff = centers[:, None, :] - centers[None, :, :]
+    dist = np.sqrt((diff ** 2).sum(axis=-1))
+    return _largest_component(dist < CLUSTER_MAX_DISTANCE)
+
+def detect_incidents(vehicle_boxes, obstacle_boxes, fire_boxes):
+    """Incidents visible in a single frame, before any merging or tracking."""
     new_incidents = []
 
     # Fire
@@ -54,31 +98,19 @@ def classify_incident(detected_objects, vehicle_boxes, obstacle_boxes, fire_boxe
     person_boxes = [v['box'] for v in vehicle_boxes if v['class'] == 'person']
     vehicle_only = [v for v in vehicle_boxes if v['class'] in VEHICLE_CLASSES]
 
-    for p_box in person_boxes:
-        for v in vehicle_only:
-            if boxes_overlap_significantly(p_box, v['box'], 0.05):
-                new_incidents.append({"type": "Person Hit", "damage": "Extreme", "priority": 1})
-                break
+    if person_boxes and vehicle_only:
+        hits = (iou_matrix(person_boxes, [v['box'] for v in vehicle_only]) > 0.05).any(axis=1)
+        for _ in range(int(hits.sum())):
+            new_incidents.append({"type": "Person Hit", "damage": "Extreme", "priority": 1})
 
     # Crash
     crash_detected = False
-    if len(vehicle_only) >= 2:
-        for i in range(len(vehicle_only)):
-            for j in range(i+1, len(vehicle_only)):
-                if boxes_touch_or_overlap(vehicle_only[i]['box'], vehicle_only[j]['box']):
-                    crash_detected = True
-                    break
-            if crash_detected:
-                break
-
-    if not crash_detected:
-        for v in vehicle_only:
-            for o_box in obstacle_boxes:
-                if boxes_touch_or_overlap(v['box'], o_box):
-                    crash_detected = True
-                    break
-            if crash_detected:
-                break
+    vehicle_only_boxes = [v['box'] for v in vehicle_only]
+    if len(vehicle_only_boxes) >= 2:
+        crash_detected = bool(np.triu(touch_matrix(vehicle_only_boxes, vehicle_only_boxes), k=1).any())
+
+    if not crash_detected and vehicle_only_boxes and obstacle_boxes:
+        crash_detected = bool(touch_matrix(vehicle_only_boxes, obstacle_boxes).any())
 
     if crash_detected:
         new_incidents.append({"type": "Crash", "damage": "High", "priority": 1})
@@ -88,6 +120,74 @@ def classify_incident(detected_objects, vehicle_boxes, obstacle_boxes, fire_boxe
     if largest_cluster >= JAM_CLUSTER_SIZE:
         new_incidents.append({"type": "Jam", "damage": "Low", "priority": 3})
 
+    return new_incidents
+
+class IncidentTracker:
+    """
+    Debounces per-frame incidents over time for one camera.
+
+    An incident type activates when it appears in `min_hits` of the last
+    `window` frames, keeps a stable id while active, and expires once it has
+    not been seen for `expiry_seconds`.
+    """
+    def __init__(self, window=INCIDENT_WINDOW, min_hits=INCIDENT_MIN_HITS, expiry_seconds=INCIDENT_EXPIRY_SECONDS):
+        self.min_hits = min_hits
+        self.expiry_seconds = expiry_seconds
+        self._history = deque(maxlen=window)
+        self._last_seen = {}
+        self._active = {}
+        self.on_opened = []  # callbacks(incidents) run with the incidents each update() opened
+
+    def update(self, new_incidents, now=None):
+        """Feed one frame's incidents; returns the active incidents sorted by priority."""
+        now = time.time() if now is None else now
+        frame_incidents = {inc['type']: inc for inc in new_incidents}
+        self._history.append(set(frame_incidents))
+        for inc_type in frame_incidents:
+            self._last_seen[inc_type] = now
+
+        opened = []
+        for inc_type, inc in frame_incidents.items():
+            if inc_type in self._active:
+                continue
+            hits = sum(1 for types in self._history if inc_type in types)
+            if hits >= self.min_hits:
+                self._active[inc_type] = dict(inc, id=uuid.uuid4().hex[:12], since=now)
+                opened.append(dict(self._active[inc_type]))
+
+        for inc_type in list(self._active):
+            if now - self._last_seen.get(inc_type, 0) > self.expiry_seconds:
+                del self._active[inc_type]
+
+        if opened:
+            for callback in self.on_opened:
+                try:
+                    callback(opened)
+                except Exception as e:
+                    print("Incident tracker callback error:", e)
+
+        return sorted((dict(inc) for inc in self._active.values()), key=lambda x: x['priority'])
+
+    def recent_types(self):
+        """Incident types seen in the current window, whether or not they have activated yet."""
+        return set().union(*self._history) | set(self._active)
+
+def classify_incident(detected_objects, vehicle_boxes, obstacle_boxes, fire_boxes, active_incidents=None, tracker=None):
+    """
+    Classify one frame. With an IncidentTracker, active incidents are
+    debounced and expire; without one, new incidents are merged into
+    `active_incidents` and never removed.
+    """
+    new_incidents = detect_incidents(vehicle_boxes, obstacle_boxes, fire_boxes)
+
+    if tracker is not None:
+        active_incidents = tracker.update(new_incidents)
+        if not active_incidents:
+            active_incidents = [{"type": "Normal Flow", "damage": "None", "priority": 4}]
+        new_incidents = []
+    elif active_incidents is None:
+        active_incidents = []
+
     # Normal flow
     if not new_incidents and not active_incidents:
         new_incidents.append({"type": "Normal Flow", "damage": "None", "priority": 4})
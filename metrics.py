@@ -0,0 +1,164 @@
+# metrics.py
+# In-process counters and timing histograms, rendered in the Prometheus text format.
+import time
+import bisect
+import threading
+import contextlib
+from config import METRICS_ENABLED
+
+# Seconds; covers sub-millisecond numpy work up to multi-second T5/Twilio calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_CONTEXT = contextlib.nullcontext()
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        if not REGISTRY.enabled:
+            return
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_format_labels(key)} {_format_value(v)}" for key, v in values.items()]
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not REGISTRY.enabled:
+            return
+        key = _label_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    @contextlib.contextmanager
+    def _timer(self, labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def time(self, **labels):
+        """Context manager observing the elapsed seconds; free when metrics are disabled."""
+        if not REGISTRY.enabled:
+            return _NULL_CONTEXT
+        return self._timer(labels)
+
+    def render(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {values[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {cumulative}")
+        return lines
+
+class Collector:
+    """
+    Values read from existing state at scrape time (queue depths, capture
+    counters, ...), so they add nothing to the hot path. `fn` returns a number
+    or a list of (labels dict, number).
+    """
+    def __init__(self, name, help_text, fn, metric_type="gauge"):
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.type = metric_type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Metric collector {self.name} failed:", e)
+            return lines
+        if values is None:
+            return lines
+        if not isinstance(values, list):
+            values = [({}, values)]
+        lines += [f"{self.name}{_format_labels(_label_key(labels))} {_format_value(v)}" for labels, v in values]
+        return lines
+
+class Registry:
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, name, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def counter(self, name, help_text):
+        return self._register(name, lambda: Counter(name, help_text))
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        return self._register(name, lambda: Histogram(name, help_text, buckets))
+
+    def collector(self, name, help_text, fn, metric_type="gauge"):
+        """Register (or replace) a scrape-time collector."""
+        with self._lock:
+            self._metrics[name] = Collector(name, help_text, fn, metric_type)
+            return self._metrics[name]
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+# --- Per-frame pipeline stages ---
+STAGE_SECONDS = REGISTRY.histogram("resq_stage_seconds", "Time spent in each per-frame pipeline stage.")
+
+class PipelineTimer:
+    """Stage timer for detector._analyze_frame backed by STAGE_SECONDS."""
+    def stage(self, name):
+        return STAGE_SECONDS.time(stage=name)
+
+PIPELINE_TIMER = PipelineTimer()
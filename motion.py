@@ -0,0 +1,82 @@
+# motion.py
+# Cheap scene-change gate that lets the detector skip near-identical frames.
+import time
+import numpy as np
+import cv2
+from metrics import REGISTRY
+from config import MOTION_WIDTH, MOTION_PIXEL_THRESHOLD, MOTION_MIN_CHANGED_RATIO, MOTION_REFRESH_SECONDS
+
+GATE_DECISIONS = REGISTRY.counter("resq_motion_gate_total",
+                                  "Motion gate decisions per camera (analyzed/refresh/skipped).")
+
+class MotionGate:
+    """
+    Compares a small grayscale copy of each frame with the last frame that was
+    fully analysed. A frame is analysed if at least MOTION_MIN_CHANGED_RATIO
+    of its pixels changed by more than MOTION_PIXEL_THRESHOLD, or if
+    MOTION_REFRESH_SECONDS have passed since the last analysis; otherwise the
+    previous results can be reused. Comparing against the last analysed frame
+    (not the previous one) means slow changes still add up and trigger.
+    """
+    def __init__(self, name="", width=MOTION_WIDTH, pixel_threshold=MOTION_PIXEL_THRESHOLD,
+                 min_changed_ratio=MOTION_MIN_CHANGED_RATIO, refresh_seconds=MOTION_REFRESH_SECONDS):
+        self.name = name
+        self.width = width
+        self.pixel_threshold = pixel_threshold
+        self.min_changed_ratio = min_changed_ratio
+        self.refresh_seconds = refresh_seconds
+        self._shape = None
+        self._small = None
+        self._gray = None
+        self._reference = None
+        self._diff = None
+        self._last_analyzed = 0.0
+        self.analyzed = 0
+        self.skipped = 0
+        self.changed_ratio = 1.0
+
+    def _allocate(self, shape):
+        h, w = shape[:2]
+        scale = min(1.0, self.width / w)
+        self._size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        self._small = np.empty((self._size[1], self._size[0], 3), dtype=np.uint8)
+        self._gray = np.empty((self._size[1], self._size[0]), dtype=np.uint8)
+        self._diff = np.empty_like(self._gray)
+        self._reference = None
+        self._shape = shape
+
+    def should_analyze(self, frame, now=None):
+        """True if `frame` differs enough from the last analysed frame (or a refresh is due)."""
+        now = time.monotonic() if now is None else now
+        if frame.shape != self._shape:
+            self._allocate(frame.shape)
+        # Nearest neighbour keeps the gate well under a millisecond; the blur
+        # evens out single-pixel sensor noise that sampling would pass through
+        cv2.resize(frame, self._size, dst=self._small, interpolation=cv2.INTER_NEAREST)
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        cv2.GaussianBlur(self._gray, (5, 5), 0, dst=self._gray)
+
+        if self._reference is None:
+            result = "analyzed"
+            self.changed_ratio = 1.0
+        else:
+            cv2.absdiff(self._gray, self._reference, dst=self._diff)
+            self.changed_ratio = np.count_nonzero(self._diff > self.pixel_threshold) / self._diff.size
+            if self.changed_ratio >= self.min_changed_ratio:
+                result = "analyzed"
+            elif now - self._last_analyzed >= self.refresh_seconds:
+                result = "refresh"
+            else:
+                result = "skipped"
+
+        GATE_DECISIONS.inc(camera=self.name, result=result)
+        if result == "skipped":
+            self.skipped += 1
+            return False
+        self.analyzed += 1
+        self._last_analyzed = now
+        if self._reference is None:
+            self._reference = self._gray.copy()
+        else:
+            self._reference[:] = self._gray
+        return True
@@ -0,0 +1,182 @@
+# outbox.py
+# Durable outbound alert queue (SQLite, WAL) drained by a background sender.
+import json
+import time
+import sqlite3
+import threading
+from config import (
+    OUTBOX_PATH, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE_DELAY, OUTBOX_POLL_INTERVAL, OUTBOX_CLAIM_TIMEOUT,
+    DISPATCH_WORKERS
+)
+
+STATUS_PENDING = "pending"
+STATUS_SENDING = "sending"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    sid TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+"""
+
+class AlertOutbox:
+    """
+    Persistent queue of alert messages with at-least-once delivery.
+
+    `enqueue()` only writes to SQLite and returns immediately; duplicate
+    idempotency keys are ignored. A sender thread claims due rows, hands them
+    to the dispatcher, and records the outcome, retrying failures with
+    backoff up to OUTBOX_MAX_ATTEMPTS. Rows left 'sending' by a crashed
+    sender are claimed again after OUTBOX_CLAIM_TIMEOUT; several processes
+    may share one outbox file. `on_status(message, status, sid)` is called
+    after every status change.
+    """
+    def __init__(self, path=OUTBOX_PATH, dispatcher=None, on_status=None):
+        self.path = path
+        self.on_status = on_status
+        self._dispatcher = dispatcher
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._in_flight = 0
+        self._thread = None
+
+    @property
+    def dispatcher(self):
+        if self._dispatcher is None:
+            from dispatch import DISPATCHER
+            self._dispatcher = DISPATCHER
+        return self._dispatcher
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="alert-outbox", daemon=True)
+            self._thread.start()
+        return self
+
+    def enqueue(self, messages):
+        """
+        Persist `messages` (dicts with an 'idempotency_key'). Returns
+        {idempotency_key: status}, including the status of keys already queued.
+        """
+        now = time.time()
+        statuses = {}
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for message in messages:
+                    key = message['idempotency_key']
+                    self._conn.execute(
+                        "INSERT OR IGNORE INTO outbox (idempotency_key, payload, status, created_at, updated_at,"
+                        " next_attempt_at) VALUES (?, ?, ?, ?, ?, ?)",
+                        (key, json.dumps(message, default=str), STATUS_PENDING, now, now, now)
+                    )
+                    row = self._conn.execute("SELECT status FROM outbox WHERE idempotency_key = ?", (key,)).fetchone()
+                    statuses[key] = row[0]
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._wakeup.set()
+        return statuses
+
+    def status(self, idempotency_key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, sid, attempts FROM outbox WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+        return {"status": row[0], "sid": row[1], "attempts": row[2]} if row else None
+
+    def counts(self):
+        """Number of rows per status."""
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def _claim(self, limit):
+        now = time.time()
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so several processes
+            # sharing the outbox file never claim the same row
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Rows another process claimed and never completed count as pending
+                rows = self._conn.execute(
+                    "SELECT id, payload, attempts FROM outbox WHERE (status = ? AND next_attempt_at <= ?)"
+                    " OR (status = ? AND updated_at <= ?) ORDER BY id LIMIT ?",
+                    (STATUS_PENDING, now, STATUS_SENDING, now - OUTBOX_CLAIM_TIMEOUT, limit)
+                ).fetchall()
+                if rows:
+                    self._conn.executemany(
+                        "UPDATE outbox SET status = ?, updated_at = ? WHERE id = ?",
+                        [(STATUS_SENDING, now, row[0]) for row in rows]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._in_flight += len(rows)
+        return rows
+
+    def _complete(self, row_id, message, attempts, future):
+        error = None
+        try:
+            sid = future.result()
+        except Exception as e:
+            sid, error = None, str(e)
+        now = time.time()
+        attempts += 1
+        if sid is not None:
+            status = STATUS_SENT
+            next_attempt = now
+        elif attempts >= OUTBOX_MAX_ATTEMPTS:
+            status = STATUS_FAILED
+            next_attempt = now
+        else:
+            status = STATUS_PENDING
+            next_attempt = now + OUTBOX_RETRY_BASE_DELAY * (2 ** (attempts - 1))
+        with self._lock:
+            self._conn.execute(
+                "UPDATE outbox SET status = ?, attempts = ?, sid = ?, last_error = ?, updated_at = ?,"
+                " next_attempt_at = ? WHERE id = ?",
+                (status, attempts, sid, error or (None if sid else "send failed"), now, next_attempt, row_id)
+            )
+            self._in_flight -= 1
+        self._wakeup.set()
+        if self.on_status is not None:
+            try:
+                self.on_status(message, status, sid)
+            except Exception as e:
+                print("Outbox status callback error:", e)
+
+    def _run(self):
+        while True:
+            self._wakeup.clear()
+            capacity = DISPATCH_WORKERS - self._in_flight
+            rows = self._claim(capacity) if capacity > 0 else []
+            for row_id, payload, attempts in rows:
+                message = json.loads(payload)
+                if self.on_status is not None:
+                    try:
+                        self.on_status(message, STATUS_SENDING, None)
+                    except Exception as e:
+                        print("Outbox status callback error:", e)
+                future = self.dispatcher.submit(message)
+                future.add_done_callback(
+                    lambda f, row_id=row_id, message=message, attempts=attempts: self._complete(row_id, message, attempts, f)
+                )
+            if not rows:
+                self._wakeup.wait(OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,114 @@
+# profiles.py
+# Per-camera analysis profiles: region-of-interest polygons, model input size and tiling.
+import numpy as np
+import cv2
+from config import CAMERA_PROFILES, DETECT_INPUT_SIZE, DETECT_TILE_OVERLAP
+
+class CameraProfile:
+    """
+    How one camera's frames are fed to the object detector.
+
+    `roi` is a list of polygons with [x, y] points normalised to 0..1. The
+    detector only sees the bounding rectangle of the polygons, with pixels
+    outside them blacked out, and detections or fire boxes whose centre lies
+    outside every polygon are dropped before classification. `input_size` is
+    the MobileNet input side, and `tiles` = [columns, rows] splits the region
+    into overlapping tiles that are detected separately, so distant objects
+    in a high-resolution frame are not shrunk away. Masks and tile rectangles
+    are computed once per frame size.
+    """
+    def __init__(self, roi=None, input_size=DETECT_INPUT_SIZE, tiles=(1, 1), tile_overlap=DETECT_TILE_OVERLAP):
+        self.polygons = [np.asarray(polygon, dtype=np.float32).reshape(-1, 2) for polygon in roi or []]
+        self.input_size = int(input_size)
+        self.tiles = (max(1, int(tiles[0])), max(1, int(tiles[1])))
+        self.tile_overlap = tile_overlap
+        self._shape = None
+        self._crop = None
+        self._crop_mask = None
+        self._masked = None
+        self._tile_rects = []
+
+    @classmethod
+    def for_camera(cls, camera_id):
+        return cls(**CAMERA_PROFILES.get(camera_id, {}))
+
+    @property
+    def tiled(self):
+        return self.tiles != (1, 1)
+
+    def _allocate(self, shape):
+        h, w = shape[:2]
+        x0, y0, x1, y1 = 0, 0, w, h
+        self._crop_mask = self._masked = None
+        if self.polygons:
+            mask = np.zeros((h, w), dtype=np.uint8)
+            points = [np.round(p * [w, h]).astype(np.int32) for p in self.polygons]
+            cv2.fillPoly(mask, points, 255)
+            bx, by, bw, bh = cv2.boundingRect(np.concatenate(points))
+            x0, y0 = max(0, bx), max(0, by)
+            x1, y1 = min(w, bx + bw), min(h, by + bh)
+            if x1 > x0 and y1 > y0:
+                self._crop_mask = mask[y0:y1, x0:x1].copy()
+                self._masked = np.empty((y1 - y0, x1 - x0) + tuple(shape[2:]), dtype=np.uint8)
+            else:
+                x0, y0, x1, y1 = 0, 0, w, h
+        self._crop = (x0, y0, x1, y1)
+
+        # Tiles cover the crop evenly, each stretched by tile_overlap so that
+        # objects on a seam are whole in at least one of them
+        cw, ch = x1 - x0, y1 - y0
+        cols, rows = self.tiles
+        tw = min(cw, int(np.ceil(cw / cols * (1 + self.tile_overlap))))
+        th = min(ch, int(np.ceil(ch / rows * (1 + self.tile_overlap))))
+        xs = [round(i * (cw - tw) / (cols - 1)) if cols > 1 else 0 for i in range(cols)]
+        ys = [round(j * (ch - th) / (rows - 1)) if rows > 1 else 0 for j in range(rows)]
+        self._tile_rects = [(tx, ty, tx + tw, ty + th) for ty in ys for tx in xs]
+        self._shape = shape
+
+    def crop_rect(self, frame):
+        """Pixel (x0, y0, x1, y1) of the area the detector looks at: the ROI bounding box or the whole frame."""
+        if frame.shape != self._shape:
+            self._allocate(frame.shape)
+        return self._crop
+
+    def regions(self, frame):
+        """
+        Images to run the detector on, as (image, (x, y) offset in `frame`)
+        pairs. The images are views into a buffer reused for the next frame.
+        """
+        if frame.shape != self._shape:
+            self._allocate(frame.shape)
+        x0, y0, x1, y1 = self._crop
+        crop = frame[y0:y1, x0:x1]
+        if self._crop_mask is not None:
+            self._masked[:] = 0
+            cv2.copyTo(crop, self._crop_mask, self._masked)
+            crop = self._masked
+        return [(crop[ty0:ty1, tx0:tx1], (x0 + tx0, y0 + ty0)) for tx0, ty0, tx1, ty1 in self._tile_rects]
+
+    def contains(self, x, y):
+        """True if the normalised point (x, y) is inside the ROI (always, without one)."""
+        if not self.polygons:
+            return True
+        return any(cv2.pointPolygonTest(polygon, (float(x), float(y)), False) >= 0 for polygon in self.polygons)
+
+    def filter_detections(self, detections):
+        """Detections (normalised boxes) whose centre is inside the ROI."""
+        if not self.polygons:
+            return detections
+        return [d for d in detections
+                if self.contains((d['box'][0] + d['box'][2]) / 2, (d['box'][1] + d['box'][3]) / 2)]
+
+    def filter_pixel_boxes(self, boxes, shape):
+        """Pixel [x1, y1, x2, y2] boxes in a frame of `shape` whose centre is inside the ROI."""
+        if not self.polygons:
+            return boxes
+        h, w = shape[:2]
+        return [b for b in boxes if self.contains((b[0] + b[2]) / 2 / w, (b[1] + b[3]) / 2 / h)]
+
+    def draw(self, frame, color=(255, 128, 0)):
+        """Outline the ROI polygons on `frame`."""
+        if self.polygons:
+            h, w = frame.shape[:2]
+            points = [np.round(p * [w, h]).astype(np.int32) for p in self.polygons]
+            cv2.polylines(frame, points, True, color, 1)
@@ -0,0 +1,122 @@
+# report_service.py
+# Generates T5 incident reports on a background worker so the detector
+# never waits on text generation.
+import threading
+from collections import Counter, OrderedDict
+from metrics import REGISTRY
+from config import REPORT_CACHE_SIZE
+
+CACHE_REQUESTS = REGISTRY.counter("resq_report_cache_total", "Incident report cache lookups by result (hit/miss).")
+
+def normalize_objects(detected_objects):
+    """Order-independent multiset of detected object names, e.g. (('car', 2), ('person', 1))."""
+    return tuple(sorted(Counter(o.strip().lower() for o in detected_objects).items()))
+
+def incident_key(incident, detected_objects):
+    """Cache key for a single incident report."""
+    return (
+        incident['type'],
+        normalize_objects(detected_objects),
+        f"{incident['type']} (P{incident['priority']})"
+    )
+
+class ReportService:
+    """
+    Per-camera report generation off the detection loop.
+
+    `request()` is cheap and never blocks: it only queues work when the set of
+    active incidents for a camera changes, and newer requests replace older
+    pending ones. `latest()` returns the last completed report for a camera.
+    Individual incident reports are kept in an LRU cache; cache misses for a
+    request are generated together with one batched T5 call.
+    """
+    def __init__(self, generate_batch_fn=None, cache_size=REPORT_CACHE_SIZE):
+        self._generate_batch_fn = generate_batch_fn
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._pending = OrderedDict()  # camera_id -> (signature, incidents, objects)
+        self._requested = {}  # camera_id -> signature last queued
+        self._latest = {}  # camera_id -> (signature, report_text)
+        self._thread = None
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="report-service", daemon=True)
+            self._thread.start()
+
+    def request(self, camera_id, active_incidents, detected_objects):
+        signature = tuple((inc['type'], inc['priority']) for inc in active_incidents)
+        with self._cond:
+            if self._requested.get(camera_id) == signature:
+                return
+            self._requested[camera_id] = signature
+            self._pending[camera_id] = (signature, list(active_incidents), list(detected_objects))
+            self._pending.move_to_end(camera_id)
+            self._start()
+            self._cond.notify()
+
+    def latest(self, camera_id):
+        """Last completed report text for `camera_id`, or None if none has finished yet."""
+        with self._lock:
+            entry = self._latest.get(camera_id)
+        return entry[1] if entry else None
+
+    def _cache_get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                CACHE_REQUESTS.inc(result="hit")
+                return self._cache[key]
+        CACHE_REQUESTS.inc(result="miss")
+        return None
+
+    def _cache_put(self, key, text):
+        with self._lock:
+            self._cache[key] = text
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    def _generate(self, incidents, detected_objects):
+        keys = [incident_key(inc, detected_objects) for inc in incidents]
+        texts = [self._cache_get(key) for key in keys]
+        missing = [i for i, text in enumerate(texts) if text is None]
+        if missing:
+            generate_batch = self._generate_batch_fn
+            if generate_batch is None:
+                from t5_generator import generate_reports_batch as generate_batch
+            generated = generate_batch([{
+                "incident_type": keys[i][0],
+                "objects_detected": detected_objects,
+                "multi_incident_string": keys[i][2]
+            } for i in missing])
+            for i, text in zip(missing, generated):
+                texts[i] = text
+                self._cache_put(keys[i], text)
+        return texts
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                camera_id, (signature, incidents, objects) = self._pending.popitem(last=False)
+
+            try:
+                reports = self._generate(incidents, objects)
+            except Exception as e:
+                print("Report generation error for", [inc['type'] for inc in incidents], ":", e)
+                reports = []
+
+            report_text = "\n\n".join(reports) if reports else "Report generation failed."
+            with self._lock:
+                self._latest[camera_id] = (signature, report_text)
+
+    def pending(self):
+        with self._lock:
+            return len(self._pending)
+
+REPORT_SERVICE = ReportService()
+REGISTRY.collector("resq_report_queue_depth", "Cameras waiting for a report.", REPORT_SERVICE.pending)
@@ -0,0 +1,189 @@
+# rollups.py
+# Incrementally maintained incident statistics, updated as incident activations and logs are written.
+import threading
+from datetime import datetime
+from pymongo import UpdateOne, ASCENDING
+from pymongo.errors import BulkWriteError
+from config import MONGO_ROLLUP_COLLECTION, LATENCY_BUCKETS
+from db_utils import get_database, DUPLICATE_KEY_ERROR
+
+ROLLUP_COUNT = "count"  # incidents opened by the trackers
+ROLLUP_DISPATCHED = "dispatched"  # incidents responders were alerted for
+ROLLUP_LATENCY = "latency"
+COUNT_KINDS = (ROLLUP_COUNT, ROLLUP_DISPATCHED)
+BUCKETS = ("hour", "day")
+
+def bucket_start(timestamp, bucket):
+    if bucket == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unknown bucket: {bucket!r}")
+
+def _latency_field(seconds):
+    for bound in LATENCY_BUCKETS:
+        if seconds <= bound:
+            return f"le_{bound}"
+    return "le_inf"
+
+def _counted_once(rollup_id, item, update):
+    """
+    Upsert that applies `update` only if `item` was not counted in this rollup
+    before. A repeat fails the filter, the upsert then collides on _id and the
+    duplicate-key error is ignored, so replayed logs are never double counted.
+    """
+    update = dict(update)
+    update["$push"] = {"seen": item}
+    return UpdateOne({"_id": rollup_id, "seen": {"$ne": item}}, update, upsert=True)
+
+class IncidentRollups:
+    """
+    Per-type counts per hour/day per camera of incidents opened and of
+    incidents dispatched, plus a daily histogram of dispatch confirmation
+    latency, kept in MONGO_ROLLUP_COLLECTION. `apply_activations(docs)` is
+    registered on the activation log writer and `apply(docs)` on the incident
+    log writer, so dashboards read a few small rollup documents instead of
+    scanning the logs.
+    """
+    def __init__(self, database_fn=get_database, collection_name=MONGO_ROLLUP_COLLECTION):
+        self.database_fn = database_fn
+        self.collection_name = collection_name
+        self._indexed = False
+        self._lock = threading.Lock()
+
+    def collection(self):
+        database = self.database_fn()
+        if database is None:
+            return None
+        collection = database[self.collection_name]
+        if not self._indexed:
+            with self._lock:
+                if not self._indexed:
+                    collection.create_index([("kind", ASCENDING), ("bucket", ASCENDING), ("start", ASCENDING)],
+                                            name="kind_bucket_start")
+                    self._indexed = True
+        return collection
+
+    def _count_updates(self, kind, doc, incidents):
+        logged_at = doc.get('timestamp') or datetime.now()
+        camera_id = doc.get('camera_id')
+        ops = []
+        for incident in incidents:
+            if incident.get('type', '').lower() == 'normal flow':
+                continue
+            # Bucketed on when the incident started, not when it was logged:
+            # the same incident is logged again on dispatch, replies and
+            # cancel, possibly in a later hour or day
+            started = datetime.fromtimestamp(incident['since']) if incident.get('since') else logged_at
+            for bucket in BUCKETS:
+                start = bucket_start(started, bucket)
+                rollup_id = f"{kind}|{bucket}|{start.isoformat()}|{camera_id}|{incident['type']}"
+                ops.append(_counted_once(rollup_id, incident['id'], {
+                    "$inc": {"count": 1},
+                    "$setOnInsert": {"kind": kind, "bucket": bucket, "start": start,
+                                     "camera_id": camera_id, "type": incident['type']}
+                }))
+        return ops
+
+    def activation_updates(self, doc):
+        """Rollup upserts for one activation document (the incidents a tracker just opened)."""
+        return self._count_updates(ROLLUP_COUNT, doc, doc.get('incidents', []))
+
+    def updates(self, doc):
+        """Rollup upserts for one logged incident (dispatch, cancel or reply) document."""
+        ops = self._count_updates(ROLLUP_DISPATCHED, doc, doc.get('dispatched', []))
+        for number, entry in (doc.get('dispatch_status') or {}).items():
+            dispatched_at, confirmed_at = entry.get('dispatched_at'), entry.get('confirmed_at')
+            if dispatched_at is None or confirmed_at is None:
+                continue
+            latency = max(0.0, confirmed_at - dispatched_at)
+            start = bucket_start(datetime.fromtimestamp(confirmed_at), "day")
+            ops.append(_counted_once(f"{ROLLUP_LATENCY}|day|{start.isoformat()}", f"{entry.get('incident_id')}:{number}", {
+                "$inc": {"count": 1, "sum": latency, f"histogram.{_latency_field(latency)}": 1},
+                "$max": {"max": latency},
+                "$setOnInsert": {"kind": ROLLUP_LATENCY, "bucket": "day", "start": start}
+            }))
+        return ops
+
+    def apply(self, docs):
+        self._write([op for doc in docs for op in self.updates(doc)])
+
+    def apply_activations(self, docs):
+        self._write([op for doc in docs for op in self.activation_updates(doc)])
+
+    def _write(self, ops):
+        if not ops:
+            return
+        collection = self.collection()
+        if collection is None:
+            return
+        try:
+            collection.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != DUPLICATE_KEY_ERROR]
+            if errors:
+                print("Rollup update errors:", errors[:3])
+
+    def incident_counts(self, bucket="hour", since=None, until=None, incident_type=None, camera_id=None,
+                        kind=ROLLUP_COUNT):
+        """
+        Counts per (bucket start, type, camera), oldest first: of incidents
+        opened, or with kind=ROLLUP_DISPATCHED of incidents dispatched.
+        """
+        if bucket not in BUCKETS:
+            raise ValueError(f"Unknown bucket: {bucket!r}")
+        if kind not in COUNT_KINDS:
+            raise ValueError(f"Unknown count kind: {kind!r}")
+        collection = self.collection()
+        if collection is None:
+            return []
+        query = {"kind": kind, "bucket": bucket}
+        query.update(_time_range(since, until))
+        if incident_type:
+            query["type"] = incident_type
+        if camera_id:
+            query["camera_id"] = camera_id
+        projection = {"_id": 0, "start": 1, "type": 1, "camera_id": 1, "count": 1}
+        return list(collection.find(query, projection).sort("start", ASCENDING))
+
+    def confirmation_latency(self, since=None, until=None):
+        """Dispatch confirmation latency (seconds) over the daily histograms in range."""
+        collection = self.collection()
+        summary = {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+        if collection is None:
+            return summary
+        query = {"kind": ROLLUP_LATENCY, "bucket": "day"}
+        query.update(_time_range(since, until))
+        histogram, total, count, longest = {}, 0.0, 0, None
+        for rollup in collection.find(query, {"seen": 0}):
+            count += rollup.get('count', 0)
+            total += rollup.get('sum', 0.0)
+            longest = rollup['max'] if longest is None else max(longest, rollup.get('max', 0.0))
+            for field, n in rollup.get('histogram', {}).items():
+                histogram[field] = histogram.get(field, 0) + n
+        if not count:
+            return summary
+        summary.update(count=count, mean=total / count, max=longest)
+        for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+            summary[name] = _histogram_quantile(histogram, count, q, longest)
+        return summary
+
+def _time_range(since, until):
+    time_range = {}
+    if since is not None:
+        time_range["$gte"] = since
+    if until is not None:
+        time_range["$lt"] = until
+    return {"start": time_range} if time_range else {}
+
+def _histogram_quantile(histogram, count, q, longest):
+    """Upper bound of the histogram bucket holding quantile `q` (capped at the observed max)."""
+    rank = q * count
+    seen = 0
+    for bound in LATENCY_BUCKETS:
+        seen += histogram.get(f"le_{bound}", 0)
+        if seen >= rank:
+            return min(bound, longest)
+    return longest
+
+INCIDENT_ROLLUPS = IncidentRollups()
@@ -0,0 +1,306 @@
+# shared_frames.py
+# Shared-memory frame ring and state channel between the detector process and web workers.
+import sys
+import json
+import time
+import threading
+from multiprocessing import shared_memory
+import numpy as np
+import cv2
+from config import (
+    SHARED_FRAME_SLOTS, SHARED_FRAME_MAX_WIDTH, SHARED_FRAME_MAX_HEIGHT, SHARED_STATE_BYTES,
+    SHARED_POLL_INTERVAL, STREAM_TIERS
+)
+
+_HEADER_BYTES = 32  # ring/channel header, and each slot header: four uint64 words
+# A segment that has not changed for this long is re-mapped, in case the
+# detector process was restarted and created a new one under the same name
+_REATTACH_AFTER = 5.0
+
+def frames_name(camera_id):
+    return f"resq_{camera_id}_frames"
+
+def state_name(camera_id):
+    return f"resq_{camera_id}_state"
+
+def _attach(name):
+    """Map an existing segment without letting this process's resource tracker unlink it on exit."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+def _create(name, size):
+    try:
+        # A segment left behind by a crashed detector is replaced
+        stale = _attach(name)
+        stale.close()
+        stale.unlink()
+    except FileNotFoundError:
+        pass
+    return shared_memory.SharedMemory(name=name, create=True, size=size)
+
+class FrameRing:
+    """
+    Fixed ring of `slots` BGR frames (up to max_height x max_width) in shared
+    memory. One writer, any number of readers in other processes.
+
+    Layout: header [latest seq, slots, slot bytes, -], then per slot a header
+    [seq, height, width, channels] followed by the pixels. The writer zeroes a
+    slot's seq before overwriting it, so a reader holding a zero-copy view
+    checks `is_current(seq)` after using it to detect a torn frame.
+    """
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self.max_width, self.max_height = SHARED_FRAME_MAX_WIDTH, SHARED_FRAME_MAX_HEIGHT
+        header = np.ndarray((4,), dtype=np.uint64, buffer=shm.buf)
+        self._header = header
+        self.slots = int(header[1])
+        self.slot_bytes = int(header[2])
+        self._slot_headers = []
+        self._slot_data = []
+        stride = _HEADER_BYTES + self.slot_bytes
+        for i in range(self.slots):
+            offset = _HEADER_BYTES + i * stride
+            self._slot_headers.append(np.ndarray((4,), dtype=np.uint64, buffer=shm.buf, offset=offset))
+            self._slot_data.append(np.ndarray((self.slot_bytes,), dtype=np.uint8, buffer=shm.buf,
+                                              offset=offset + _HEADER_BYTES))
+
+    @classmethod
+    def create(cls, name, slots=SHARED_FRAME_SLOTS, max_width=SHARED_FRAME_MAX_WIDTH,
+               max_height=SHARED_FRAME_MAX_HEIGHT):
+        slot_bytes = max_width * max_height * 3
+        shm = _create(name, _HEADER_BYTES + slots * (_HEADER_BYTES + slot_bytes))
+        header = np.ndarray((4,), dtype=np.uint64, buffer=shm.buf)
+        header[:] = (0, slots, slot_bytes, 0)
+        ring = cls(shm, owner=True)
+        ring.max_width, ring.max_height = max_width, max_height
+        for slot_header in ring._slot_headers:
+            slot_header[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name))
+
+    @property
+    def latest(self):
+        return int(self._header[0])
+
+    def write(self, frame):
+        """Copy `frame` into the next slot (shrinking it if it exceeds the slot size)."""
+        h, w = frame.shape[:2]
+        if h * w * 3 > self.slot_bytes:
+            scale = min(self.max_width / w, self.max_height / h)
+            frame = cv2.resize(frame, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+            h, w = frame.shape[:2]
+        seq = self.latest + 1
+        slot_header = self._slot_headers[seq % self.slots]
+        slot_header[0] = 0
+        self._slot_data[seq % self.slots][:h * w * 3] = np.ascontiguousarray(frame, dtype=np.uint8).reshape(-1)
+        slot_header[1:4] = (h, w, 3)
+        slot_header[0] = seq
+        self._header[0] = seq
+        return seq
+
+    def view(self):
+        """(seq, zero-copy HxWx3 view) of the newest frame, or (0, None) if none is readable."""
+        seq = self.latest
+        if seq == 0:
+            return 0, None
+        slot_header = self._slot_headers[seq % self.slots]
+        if int(slot_header[0]) != seq:
+            return 0, None
+        h, w, c = (int(v) for v in slot_header[1:4])
+        return seq, self._slot_data[seq % self.slots][:h * w * c].reshape(h, w, c)
+
+    def is_current(self, seq):
+        """True while the slot that held `seq` has not been overwritten."""
+        return int(self._slot_headers[seq % self.slots][0]) == seq
+
+    def close(self):
+        # Views must be dropped before the mapping can be closed
+        self._header = None
+        self._slot_headers = []
+        self._slot_data = []
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+class StateChannel:
+    """
+    Latest camera state as JSON in shared memory, guarded by a sequence lock:
+    the version is odd while the writer is copying, and readers retry if it
+    changed while they read.
+    """
+    def __init__(self, shm, owner=False):
+        self.shm = shm
+        self.owner = owner
+        self._header = np.ndarray((4,), dtype=np.uint64, buffer=shm.buf)
+        self._data = np.ndarray((shm.size - _HEADER_BYTES,), dtype=np.uint8, buffer=shm.buf, offset=_HEADER_BYTES)
+
+    @classmethod
+    def create(cls, name, size=SHARED_STATE_BYTES):
+        shm = _create(name, _HEADER_BYTES + size)
+        channel = cls(shm, owner=True)
+        channel._header[:] = 0
+        return channel
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name))
+
+    @property
+    def version(self):
+        return int(self._header[0])
+
+    def write(self, state):
+        payload = json.dumps(state, default=str).encode('utf-8')
+        if len(payload) > self._data.size:
+            raise ValueError(f"State of {len(payload)} bytes exceeds the {self._data.size}-byte channel")
+        self._header[0] += 1  # odd: write in progress
+        self._data[:len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        self._header[1] = len(payload)
+        self._header[0] += 1
+
+    def read(self, retries=100):
+        """(version, state dict), or (version, None) if nothing has been written yet."""
+        for _ in range(retries):
+            version = int(self._header[0])
+            if version == 0:
+                return 0, None
+            if version % 2:
+                time.sleep(0)
+                continue
+            payload = self._data[:int(self._header[1])].tobytes()
+            if int(self._header[0]) == version:
+                return version, json.loads(payload)
+        return self.version, None
+
+    def close(self):
+        self._header = None
+        self._data = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+# --- Web worker side ---
+class SharedFrameBroadcaster:
+    """
+    Drop-in for streaming.FrameBroadcaster in a web worker: serves the frames
+    published by the detector process, JPEG-encoding straight from the shared
+    ring (once per frame and tier in this worker).
+    """
+    def __init__(self, camera_id, tiers=None, poll_interval=SHARED_POLL_INTERVAL):
+        self.camera_id = camera_id
+        self.tiers = tiers if tiers is not None else STREAM_TIERS
+        self.poll_interval = poll_interval
+        self._ring = None
+        self._ring_seq = 0
+        self._ring_changed = 0.0
+        self._lock = threading.Lock()
+        self._encoded = {}  # tier -> (seq, jpeg bytes)
+        # One encoder per tier; clients arriving meanwhile wait and take its result
+        self._tier_locks = {tier: threading.Lock() for tier in self.tiers}
+
+    def _get_ring(self):
+        with self._lock:
+            now = time.monotonic()
+            if self._ring is not None:
+                if self._ring.latest != self._ring_seq:
+                    self._ring_seq, self._ring_changed = self._ring.latest, now
+                elif now - self._ring_changed > _REATTACH_AFTER:
+                    # Dropped rather than closed: encoders may still hold views into it
+                    self._ring = None
+                    self._encoded.clear()
+            if self._ring is None:
+                try:
+                    self._ring = FrameRing.attach(frames_name(self.camera_id))
+                except FileNotFoundError:
+                    return None
+                self._ring_seq, self._ring_changed = 0, now
+            return self._ring
+
+    @property
+    def version(self):
+        ring = self._get_ring()
+        return ring.latest if ring is not None else 0
+
+    def publish(self, frame):
+        raise RuntimeError("Frames are published by the detector process")
+
+    def wait_next(self, last_version, tier, timeout=None):
+        """Same contract as FrameBroadcaster.wait_next, polling the shared ring."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ring = self._get_ring()
+            if ring is not None and ring.latest > last_version:
+                result = self._encode(ring, tier)
+                if result is not None:
+                    return result
+            if deadline is not None and time.monotonic() >= deadline:
+                return last_version, None
+            time.sleep(self.poll_interval)
+
+    def _encode(self, ring, tier):
+        with self._tier_locks[tier]:
+            with self._lock:
+                cached = self._encoded.get(tier)
+                if cached is not None and cached[0] >= ring.latest:
+                    return cached
+            return self._encode_latest(ring, tier)
+
+    def _encode_latest(self, ring, tier):
+        seq, frame = ring.view()
+        if frame is None:
+            return None
+        settings = self.tiers[tier]
+        max_w = settings.get('max_width')
+        if max_w and frame.shape[1] > max_w:
+            scale = max_w / frame.shape[1]
+            frame = cv2.resize(frame, (max_w, int(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+        ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, settings.get('quality', 80)])
+        if not ok or not ring.is_current(seq):
+            return None  # Overwritten mid-encode; take the next one
+        with self._lock:
+            self._encoded[tier] = (seq, buffer.tobytes())
+            return self._encoded[tier]
+
+def attach_remote_camera(camera, poll_interval=SHARED_POLL_INTERVAL):
+    """
+    Feed `camera` (a detector.CameraState in a web worker) from the detector
+    process: frames come from its shared ring, and state updates are merged
+    into `prediction_data` by a background thread. The detector process also
+    owns dispatch, so dispatch status arrives the same way.
+    """
+    camera.broadcaster = SharedFrameBroadcaster(camera.camera_id, poll_interval=poll_interval)
+
+    def follow_state():
+        channel, version, changed = None, 0, 0.0
+        while True:
+            if channel is None:
+                try:
+                    channel = StateChannel.attach(state_name(camera.camera_id))
+                except FileNotFoundError:
+                    time.sleep(1.0)
+                    continue
+                version, changed = 0, time.monotonic()
+            if channel.version != version:
+                new_version, state = channel.read()
+                if state is not None:
+                    version, changed = new_version, time.monotonic()
+                    camera.publish(state)
+            elif time.monotonic() - changed > _REATTACH_AFTER:
+                channel.close()
+                channel = None
+                continue
+            time.sleep(poll_interval)
+
+    threading.Thread(target=follow_state, name=f"remote-state-{camera.camera_id}", daemon=True).start()
+    return camera
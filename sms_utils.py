@@ -1,9 +1,9 @@
 # sms_utils.py
-from twilio.rest import Client
-from config import TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_FROM_NUMBER
+from config import TWILIO_FROM_NUMBER
+from dispatch import get_twilio_client
 
 def send_sms(to, body):
-    client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+    client = get_twilio_client()
     message = client.messages.create(
         body=body,
         from_=TWILIO_FROM_NUMBER,
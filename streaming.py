@@ -0,0 +1,72 @@
+# streaming.py
+# Encode-once MJPEG broadcasting for /video_feed.
+import threading
+import cv2
+from metrics import REGISTRY
+from config import STREAM_TIERS
+
+ENCODE_SECONDS = REGISTRY.histogram("resq_jpeg_encode_seconds", "Resize + JPEG encode time per stream tier.")
+ENCODE_CACHE = REGISTRY.counter("resq_jpeg_cache_total", "Encoded-frame requests by tier and cache result (hit/miss).")
+
+class FrameBroadcaster:
+    """
+    Holds the latest annotated frame of one camera with a version number.
+    Each version is JPEG-encoded at most once per quality tier, no matter how
+    many clients are watching; clients block on a condition until a newer
+    version is published.
+    """
+    def __init__(self, tiers=None):
+        self.tiers = tiers if tiers is not None else STREAM_TIERS
+        self._cond = threading.Condition()
+        self._frame = None
+        self._version = 0
+        self._encoded = {}  # tier -> (version, jpeg bytes)
+        self._encode_locks = {tier: threading.Lock() for tier in self.tiers}
+
+    @property
+    def version(self):
+        with self._cond:
+            return self._version
+
+    def publish(self, frame):
+        """Publish a new frame. The caller must not modify `frame` afterwards."""
+        with self._cond:
+            self._frame = frame
+            self._version += 1
+            self._cond.notify_all()
+
+    def wait_frame(self, last_version, timeout=None):
+        """
+        Wait until a version newer than `last_version` exists and return
+        (version, raw frame); returns (last_version, None) on timeout.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._version > last_version, timeout):
+                return last_version, None
+            return self._version, self._frame
+
+    def wait_next(self, last_version, tier, timeout=None):
+        """Like wait_frame, but returns (version, jpeg bytes) for `tier`."""
+        version, frame = self.wait_frame(last_version, timeout)
+        if frame is None:
+            return last_version, None
+        return self._encode(tier, version, frame)
+
+    def _encode(self, tier, version, frame):
+        with self._encode_locks[tier]:
+            cached = self._encoded.get(tier)
+            if cached is not None and cached[0] >= version:
+                ENCODE_CACHE.inc(tier=tier, result="hit")
+                return cached
+            ENCODE_CACHE.inc(tier=tier, result="miss")
+            settings = self.tiers[tier]
+            with ENCODE_SECONDS.time(tier=tier):
+                max_w = settings.get('max_width')
+                if max_w and frame.shape[1] > max_w:
+                    scale = max_w / frame.shape[1]
+                    frame = cv2.resize(frame, (max_w, int(frame.shape[0] * scale)), interpolation=cv2.INTER_AREA)
+                ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, settings.get('quality', 80)])
+            if not ok:
+                return version, None
+            self._encoded[tier] = (version, buffer.tobytes())
+            return self._encoded[tier]
@@ -1,26 +1,133 @@
-from transformers import T5Tokenizer, T5ForConditionalGeneration
-import torch
+import os
+import shutil
+import tempfile
+import threading
+from metrics import REGISTRY
+from config import T5_MODEL_NAME, T5_BACKEND, T5_ONNX_CACHE_DIR
 
-# Load T5 model (T5-small or a larger one if you want)
-tokenizer = T5Tokenizer.from_pretrained("t5-small")
-model = T5ForConditionalGeneration.from_pretrained("t5-small")
+GENERATE_SECONDS = REGISTRY.histogram("resq_t5_generate_seconds", "T5 generate() time per batch.")
+GENERATE_PROMPTS = REGISTRY.counter("resq_t5_prompts_total", "Prompts passed to T5 generate().")
 
-def generate_report_from_incident(incident_data):
+# --- Shared, lazily loaded T5 model ---
+# transformers/torch are imported on first use so that importing this module
+# (and starting the Flask app) stays fast.
+_tokenizer = None
+_model = None
+_model_lock = threading.Lock()
+
+def _load_onnx_model(model_name):
     """
-    Generate a textual incident report from incident data using T5.
+    Load the ONNX export of `model_name` from T5_ONNX_CACHE_DIR, exporting it
+    there first if it is missing. The export is written to a temporary
+    directory and renamed into place, so a crash or a concurrent start never
+    leaves a half-written cache behind.
+    """
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    cache_dir = os.path.join(T5_ONNX_CACHE_DIR, model_name.strip("/").replace("/", "--"))
+    if os.path.isdir(cache_dir):
+        return ORTModelForSeq2SeqLM.from_pretrained(cache_dir)
+
+    model = ORTModelForSeq2SeqLM.from_pretrained(model_name, export=True)
+    os.makedirs(T5_ONNX_CACHE_DIR, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix=".export-", dir=T5_ONNX_CACHE_DIR)
+    try:
+        model.save_pretrained(staging)
+        os.replace(staging, cache_dir)
+        print(f"T5 ONNX export cached in {cache_dir}.")
+    except OSError as e:
+        # Another process got there first, or the cache is not writable
+        print("T5 ONNX export not cached:", e)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return model
+
+def _load_model(model_name, backend):
+    from transformers import T5Tokenizer, T5ForConditionalGeneration
+    tokenizer = T5Tokenizer.from_pretrained(model_name)
+
+    if backend == "onnx":
+        try:
+            return tokenizer, _load_onnx_model(model_name)
+        except Exception as e:
+            print("ONNX Runtime backend not available, falling back to PyTorch:", e)
+
+    model = T5ForConditionalGeneration.from_pretrained(model_name)
+    model.eval()
+    if backend == "int8":
+        import torch
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return tokenizer, model
+
+def get_model():
+    """
+    Return the shared (tokenizer, model) pair, loading it on first call.
+    The checkpoint is T5_MODEL_NAME; T5_BACKEND picks "torch", "int8"
+    (dynamic quantization) or "onnx" (ONNX Runtime via optimum).
     """
+    global _tokenizer, _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _tokenizer, _model = _load_model(T5_MODEL_NAME, T5_BACKEND)
+                print(f"T5 model '{T5_MODEL_NAME}' loaded ({T5_BACKEND}).")
+    return _tokenizer, _model
+
+def warm_up_async():
+    """Load the model and run one short generation in a background thread."""
+    def _warm_up():
+        try:
+            generate_reports_batch([{"incident_type": "Normal Flow"}])
+        except Exception as e:
+            print("T5 warm-up failed:", e)
+    thread = threading.Thread(target=_warm_up, name="t5-warmup", daemon=True)
+    thread.start()
+    return thread
+
+def _generate(prompts, **generate_kwargs):
+    import torch
+    tokenizer, model = get_model()
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True)
+    GENERATE_PROMPTS.inc(len(prompts))
+    with torch.no_grad(), GENERATE_SECONDS.time():
+        outputs = model.generate(
+            inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            **generate_kwargs
+        )
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+def _report_prompt(incident_data):
     objects_str = ", ".join(incident_data.get('objects_detected', []))
     multi_incidents = incident_data.get('multi_incident_string', '')
     incident_type = incident_data.get('incident_type', 'Unknown')
+    return f"Generate a detailed incident report for a {incident_type}. " \
+           f"Detected objects: {objects_str}. Other incidents: {multi_incidents}."
 
-    prompt = f"Generate a detailed incident report for a {incident_type}. " \
-             f"Detected objects: {objects_str}. Other incidents: {multi_incidents}."
+def _next_events_prompt(current_events, max_new_events):
+    return f"Given the following incident events: {current_events}. " \
+           f"Predict the next {max_new_events} possible sequential events in order."
 
-    input_ids = tokenizer(prompt, return_tensors="pt").input_ids
-    with torch.no_grad():
-        outputs = model.generate(input_ids, max_length=150, num_beams=4, early_stopping=True)
-    report_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    return report_text
+def generate_report_from_incident(incident_data):
+    """
+    Generate a textual incident report from incident data using T5.
+    """
+    return generate_reports_batch([incident_data])[0]
+
+def generate_reports_batch(list_of_incidents):
+    """
+    Generate reports for several incidents in a single padded forward pass.
+
+    Args:
+        list_of_incidents (list of dict): incident data dicts as accepted by
+                                          generate_report_from_incident
+
+    Returns:
+        reports (list of str): one report per incident, in the same order
+    """
+    if not list_of_incidents:
+        return []
+    prompts = [_report_prompt(incident_data) for incident_data in list_of_incidents]
+    return _generate(prompts, max_length=150, num_beams=4, early_stopping=True)
 
 def generate_next_events(current_events, max_new_events=3):
     """
@@ -34,26 +141,34 @@ def generate_next_events(current_events, max_new_events=3):
     Returns:
         next_events_list (list of str): List of predicted sequential events
     """
-    prompt = f"Given the following incident events: {current_events}. " \
-             f"Predict the next {max_new_events} possible sequential events in order."
+    return generate_next_events_batch([current_events], max_new_events)[0]
 
-    input_ids = tokenizer(prompt, return_tensors="pt").input_ids
+def generate_next_events_batch(list_of_current_events, max_new_events=3):
+    """
+    Batch form of generate_next_events: one padded forward pass for all inputs.
 
-    with torch.no_grad():
-        outputs = model.generate(
-            input_ids,
-            max_length=100,
-            num_beams=4,
-            early_stopping=True,
-            do_sample=True,
-            top_p=0.9,
-            top_k=50
-        )
+    Returns:
+        list of (list of str): predicted events for each input, in the same order
+    """
+    if not list_of_current_events:
+        return []
+    prompts = [_next_events_prompt(events, max_new_events) for events in list_of_current_events]
+    generated = _generate(
+        prompts,
+        max_length=100,
+        num_beams=4,
+        early_stopping=True,
+        do_sample=True,
+        top_p=0.9,
+        top_k=50
+    )
 
-    generated_text = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    # Split generated text by semicolon or newline to get individual events
-    next_events = [e.strip() for e in generated_text.replace("\n", ";").split(";") if e.strip()]
-    return next_events[:max_new_events]
+    results = []
+    for generated_text in generated:
+        # Split generated text by semicolon or newline to get individual events
+        next_events = [e.strip() for e in generated_text.replace("\n", ";").split(";") if e.strip()]
+        results.append(next_events[:max_new_events])
+    return results
 
 # --- Example usage ---
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+# tracker.py
+# Lightweight IoU multi-object tracker so the detector can skip frames.
+import itertools
+import numpy as np
+from main import iou_matrix
+
+TRACK_IOU_THRESHOLD = 0.3
+TRACK_MAX_MISSED = 5
+VELOCITY_SMOOTHING = 0.5
+
+class ObjectTracker:
+    """
+    Associates detections across keyframes by IoU (same class only) and
+    propagates boxes between keyframes with a constant-velocity model.
+
+    Detections and tracked objects are dicts with a normalised 'box'
+    [x1, y1, x2, y2] and a 'class'; tracked objects also carry 'track_id'.
+    """
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_missed=TRACK_MAX_MISSED):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self._tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, detections):
+        """Match a keyframe's detections to existing tracks; returns the tracked objects."""
+        for track in self._tracks:
+            track['age'] += 1
+        matched_tracks = set()
+        matched_dets = set()
+        if self._tracks and detections:
+            iou = iou_matrix([t['box'] for t in self._tracks], [d['box'] for d in detections])
+            same_class = np.array([[t['class'] == d['class'] for d in detections] for t in self._tracks])
+            iou[~same_class] = 0
+            # Greedy assignment, best IoU first
+            for flat in np.argsort(iou, axis=None)[::-1]:
+                ti, di = np.unravel_index(flat, iou.shape)
+                if iou[ti, di] < self.iou_threshold:
+                    break
+                if ti in matched_tracks or di in matched_dets:
+                    continue
+                matched_tracks.add(ti)
+                matched_dets.add(di)
+                self._correct(self._tracks[ti], detections[di])
+
+        for ti, track in enumerate(self._tracks):
+            if ti not in matched_tracks:
+                track['missed'] += 1
+        self._tracks = [t for t in self._tracks if t['missed'] <= self.max_missed]
+
+        for di, det in enumerate(detections):
+            if di not in matched_dets:
+                self._tracks.append(dict(det, box=list(det['box']), anchor=list(det['box']),
+                                         track_id=next(self._ids), velocity=[0.0] * 4, missed=0, age=0))
+        return self._visible()
+
+    def predict(self):
+        """Advance every track by one frame without a detection; returns the tracked objects."""
+        for track in self._tracks:
+            track['box'] = [min(1.0, max(0.0, b + v)) for b, v in zip(track['box'], track['velocity'])]
+            track['age'] += 1
+        return self._visible()
+
+    def _correct(self, track, det):
+        # Velocity per frame, measured between this keyframe and the last one that matched
+        frames = max(1, track['age'])
+        delta = [(n - o) / frames for n, o in zip(det['box'], track['anchor'])]
+        track['velocity'] = [VELOCITY_SMOOTHING * d + (1 - VELOCITY_SMOOTHING) * v
+                             for d, v in zip(delta, track['velocity'])]
+        track.update(det)
+        track['box'] = list(det['box'])
+        track['anchor'] = list(det['box'])
+        track['missed'] = 0
+        track['age'] = 0
+
+    def _visible(self):
+        return [{k: v for k, v in t.items() if k not in ('anchor', 'velocity', 'missed', 'age')}
+                for t in self._tracks if t['missed'] == 0]